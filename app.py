@@ -1,20 +1,37 @@
 import streamlit as st
 import os
+import uuid
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables (like GOOGLE_API_KEY) from .env file
 load_dotenv()   
 
-from trip_agents import TripCrew   # import AFTER .env is loaded
+from plan_history import get_default_history   # import AFTER .env is loaded
 
 # Page config
 st.set_page_config(page_title="AI Travel Planner", page_icon="✈️", layout="wide")
 
 # --- CSS LOADING FUNCTION ---
-def load_css(file_name):
+# Read once per process; Streamlit reruns this whole script on every widget change
+@st.cache_resource
+def read_css(file_name):
     with open(file_name) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        return f.read()
+
+def load_css(file_name):
+    st.markdown(f'<style>{read_css(file_name)}</style>', unsafe_allow_html=True)
+
+# crewai takes seconds to import, so the planner is only loaded on the first
+# submit; reruns and visitors who never submit do not pay for it
+@st.cache_resource(show_spinner="🧳 Getting the travel agents ready...")
+def load_planner():
+    import trip_agents   # import AFTER .env is loaded
+    from metrics import start_metrics_server
+
+    # Prometheus /metrics endpoint, only when TRIP_METRICS_PORT is set
+    start_metrics_server()
+    return trip_agents
 
 load_css("style.css")
 
@@ -48,18 +65,160 @@ def get_trip_persona(interests, budget, duration):
             
     return best_persona
 
+# Plan sections in tab order, for comparisons and saved plans
+SECTIONS = [
+    ("planning", "📅 Itinerary"),
+    ("logistics", "✈️ Travel & Stay"),
+    ("budget", "💰 Budget"),
+    ("local_insights", "📝 Local Tips"),
+    ("experiences", "✨ Experiences"),
+]
+MAX_COMPARE_VARIANTS = 6
+
+def show_comparison(planner, comparison, show_debug):
+    import plan_schema   # already loaded with the planner
+
+    labels = comparison.labels()
+    st.info(f"⚖️ Comparing {len(labels)} variants. Sections that come out the same for every variant are planned once.")
+    progress = st.progress(0.0, text="🔄 Planning your variants... sections appear as soon as they are ready")
+
+    # (variant index, task name) -> slot; invariant sections share one slot
+    slots = {}
+    tabs = st.tabs([title for _, title in SECTIONS])
+    for (name, title), tab in zip(SECTIONS, tabs):
+        with tab:
+            if name in comparison.varying:
+                for index, column in enumerate(st.columns(len(labels))):
+                    with column:
+                        st.markdown(f"#### {labels[index]}")
+                        slots[index, name] = st.empty()
+                        slots[index, name].info("⏳ Still working on this section...")
+            else:
+                st.caption("Same for every variant")
+                slot = st.empty()
+                slot.info("⏳ Still working on this section...")
+                for index in range(len(labels)):
+                    slots[index, name] = slot
+
+    outputs = [{} for _ in labels]
+    for index, name, output in comparison.stream():
+        outputs[index][name] = output
+        slots[index, name].markdown(plan_schema.render(name, output.raw))
+        ready = sum(len(out) for out in outputs)
+        progress.progress(ready / len(slots), text=f"🔄 {ready} of {len(slots)} sections ready...")
+
+    progress.empty()
+    failed = sorted({name for crew in comparison.crews for name in crew.failed})
+    if failed:
+        st.warning(f"⚠️ Some sections could not be generated right now: {', '.join(failed)}. Submit again to retry.")
+    else:
+        st.success("✨ Your trip comparison is ready!")
+
+    for crew, out in zip(comparison.crews, outputs):
+        history.record(crew.inputs, {name: output.raw for name, output in out.items()}, crew.failed, session=SESSION_ID)
+
+    if show_debug:
+        with st.expander("🔧 Performance debug", expanded=True):
+            stats = [
+                dict(crew.stats[name].as_dict(), variant=label)
+                for crew, label in zip(comparison.crews, labels)
+                for name in crew.stats
+            ]
+            st.dataframe(stats, use_container_width=True)
+            st.caption(
+                f"Total LLM time {sum(s['llm_seconds'] for s in stats):.1f}s, "
+                f"{sum(s['llm_calls'] for s in stats)} LLM calls for {len(labels)} variants"
+            )
+
+    destination = comparison.variants[0]["destination_city"]
+    report = "\n\n".join(
+        f"TRIP PLAN FOR {destination.upper()} ({label})\n================================\n"
+        + "\n\n".join(plan_schema.render(name, out[name].raw) for name, _ in SECTIONS)
+        for label, out in zip(labels, outputs)
+    )
+    st.download_button(
+        label="📥 Download Trip Comparison",
+        data=report,
+        file_name=f"trip_comparison_{destination}.txt",
+        mime="text/plain"
+    )
+
+def plan_download(render, destination, sections):
+    # Plain-text plan for st.download_button; sections maps task name -> raw output
+    return f"""
+TRIP PLAN FOR {destination.upper()}
+================================
+LOGISTICS
+{render("logistics", sections["logistics"])}
+================================
+BUDGET
+{render("budget", sections["budget"])}
+================================
+ITINERARY
+{render("planning", sections["planning"])}
+================================
+LOCAL INSIGHTS
+{render("local_insights", sections["local_insights"])}
+================================
+EXPERIENCES
+{render("experiences", sections["experiences"])}
+"""
+
+def show_saved_plan(plan):
+    # Imported here rather than at the top, so only viewing a saved plan pays for pydantic;
+    # crewai is not needed at all
+    import plan_schema
+
+    inputs = plan["inputs"]
+    st.markdown(f"### 🗂️ Saved Plan: {inputs['destination_city']}, {inputs['duration']} days from {inputs['travel_date']}")
+    st.caption(f"Planned on {datetime.fromtimestamp(plan['created_at']):%Y-%m-%d %H:%M} and loaded from your history, without asking the AI again.")
+    if plan["failed"]:
+        st.warning(f"⚠️ Some sections could not be generated for this plan: {', '.join(plan['failed'])}.")
+    for (name, _), tab in zip(SECTIONS, st.tabs([title for _, title in SECTIONS])):
+        with tab:
+            st.markdown(plan_schema.render(name, plan["sections"][name]))
+    st.download_button(
+        label="📥 Download Complete Travel Plan",
+        data=plan_download(plan_schema.render, inputs["destination_city"], plan["sections"]),
+        file_name=f"travel_plan_{inputs['destination_city']}_{inputs['travel_date']}.txt",
+        mime="text/plain"
+    )
+
 # Load GOOGLE_API_KEY from environment
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# The offline "fake" backend (see llm_backends.py) needs no key
+LLM_BACKEND = os.getenv("TRIP_LLM_BACKEND", "gemini")
+API_KEY_MISSING = LLM_BACKEND == "gemini" and not GOOGLE_API_KEY
+
+# Kept in the URL, so reloading the page still finds this session's past plans
+if "session" not in st.query_params:
+    st.query_params["session"] = uuid.uuid4().hex
+SESSION_ID = st.query_params["session"]
+history = get_default_history()
 
 # Sidebar for settings and tips
 with st.sidebar:
     st.title("⚙️ Settings")
     # Check for GOOGLE_API_KEY
-    if not GOOGLE_API_KEY:
+    if LLM_BACKEND != "gemini":
+        st.info(f"Using the offline '{LLM_BACKEND}' LLM backend.")
+    elif not GOOGLE_API_KEY:
         st.warning("Google API key not found. Please set GOOGLE_API_KEY in your .env file.")
     else:
         st.success("Google API key loaded successfully!")
 
+    show_debug = st.checkbox("🔧 Show performance debug panel")
+
+    st.divider()
+    st.markdown("### 🗂️ Your Past Plans")
+    past_plans = history.find(session=SESSION_ID, limit=10)
+    if not past_plans:
+        st.caption("Plans you create are saved here, so you can reopen and download them instantly.")
+    for past in past_plans:
+        label = f"{past['destination']} · {past['duration']} days · {past['travel_date']}"
+        if st.button(label + (" ⚠️" if past["partial"] else ""), key=f"history_{past['id']}", use_container_width=True):
+            st.session_state["history_plan"] = past["id"]
+
     st.divider()
     st.markdown("### 💡 Trip Planning Tips")
     st.info("""
@@ -169,6 +328,20 @@ with st.form("travel_form"):
                 index=0
             )
             
+        # Plan the same trip at other budget levels or lengths, side by side
+        st.markdown("#### ⚖️ Compare Variants")
+        compare_col1, compare_col2 = st.columns(2)
+        with compare_col1:
+            compare_budgets = st.multiselect(
+                "Also Compare Budget Levels",
+                ["Budget", "Moderate", "Luxury"]
+            )
+        with compare_col2:
+            compare_durations = st.multiselect(
+                "Also Compare Trip Lengths (days)",
+                [3, 5, 7, 10, 14]
+            )
+
         # Show travel persona based on selections
         travel_persona = get_trip_persona(interests, budget, duration)
         st.markdown(f"### 🎭 Your Travel Persona: **{travel_persona}**")
@@ -233,136 +406,178 @@ with st.form("travel_form"):
     submitted = st.form_submit_button("🎯 Plan My Trip")
 
 if submitted:
-    if not GOOGLE_API_KEY:
+    st.session_state.pop("history_plan", None)
+    if API_KEY_MISSING:
         st.error("Google API key missing. Please add it to your .env file.")
     else:
         try:
-            with st.spinner("🔄 Planning your perfect trip... (This may take 1-2 minutes)"):
-                inputs = {
-                    "source_city": source_city,
-                    "destination_city": destination_city,
-                    "travel_date": departure_date.strftime("%Y-%m-%d"),
-                    "duration": duration,
-                    "preferred_time": preferred_time,
-                    "interests": interests,
-                    "budget": budget,
-                    "weather_preference": weather_preference,
-                    "location_preference": location_preference,
-                    "special_requirements": special_requirements if special_requirements else "None",
-                    
-                    "accessibility_needs": accessibility_needs,
-                    "dietary_restrictions": dietary_restrictions,
-                    "medical_needs": medical_needs,
-                    "language_preference": language_preference,
-                    "include_shopping": include_shopping,
-                    "include_nightlife": include_nightlife,
-                    "include_photography": include_photography,
-                    "include_work_spaces": include_work_spaces,
-                    "include_local_events": include_local_events,
-                    "include_wellness": include_wellness,
-                    "include_cooking": include_cooking,
-                    "include_workshops": include_workshops,
-                    "include_volunteering": include_volunteering,
-                    "travel_style": travel_style,
-                    "pace_preference": pace_preference
-                }
-                
-                trip_crew = TripCrew(inputs)
-                result = trip_crew.crew.kickoff()
+            inputs = {
+                "source_city": source_city,
+                "destination_city": destination_city,
+                "travel_date": departure_date.strftime("%Y-%m-%d"),
+                "duration": duration,
+                "preferred_time": preferred_time,
+                "interests": interests,
+                "budget": budget,
+                "weather_preference": weather_preference,
+                "location_preference": location_preference,
+                "special_requirements": special_requirements if special_requirements else "None",
                 
-                task_outputs = result.tasks_output
-                logistics_out = task_outputs[0].raw
-                budget_out = task_outputs[1].raw
-                plan_out = task_outputs[2].raw
-                insights_out = task_outputs[3].raw
-                experiences_out = task_outputs[4].raw
+                "accessibility_needs": accessibility_needs,
+                "dietary_restrictions": dietary_restrictions,
+                "medical_needs": medical_needs,
+                "language_preference": language_preference,
+                "include_shopping": include_shopping,
+                "include_nightlife": include_nightlife,
+                "include_photography": include_photography,
+                "include_work_spaces": include_work_spaces,
+                "include_local_events": include_local_events,
+                "include_wellness": include_wellness,
+                "include_cooking": include_cooking,
+                "include_workshops": include_workshops,
+                "include_volunteering": include_volunteering,
+                "travel_style": travel_style,
+                "pace_preference": pace_preference
+            }
+            
+            planner = load_planner()
+            import plan_schema   # already loaded with the planner
 
-                st.success("✨ Your comprehensive travel plan is ready!")
+            budgets = [budget] + [b for b in compare_budgets if b != budget]
+            durations = [duration] + [d for d in compare_durations if d != duration]
+            if len(budgets) * len(durations) > 1:
+                if len(budgets) * len(durations) > MAX_COMPARE_VARIANTS:
+                    st.error(f"Please compare at most {MAX_COMPARE_VARIANTS} variants at a time.")
+                else:
+                    variants = [dict(inputs, budget=b, duration=d) for b in budgets for d in durations]
+                    show_comparison(planner, planner.TripComparison(variants), show_debug)
+                st.stop()
+
+            # Only the tasks whose inputs changed since the last plan are re-run
+            trip_crew = planner.TripCrew(inputs, previous=st.session_state.get("last_trip"))
+            if trip_crew.reused:
+                st.info(f"♻️ Reusing {len(trip_crew.reused)} unchanged sections from your previous plan.")
+            progress = st.progress(0.0, text="🔄 Planning your perfect trip... sections appear as soon as they are ready")
+
+            # Interactive Results Display
+            overview_tab, plan_tab, logistics_tab, budget_tab, tips_tab, extras_tab = st.tabs([
+                "🌟 Overview", "📅 Itinerary", "✈️ Travel & Stay", "💰 Budget", "📝 Local Tips", "✨ Extras"
+            ])
+            
+            with overview_tab:
+                st.markdown("### 🌟 Trip Overview")
+                col1, col2, col3 = st.columns([2,1,1])
                 
-                # Interactive Results Display
-                overview_tab, plan_tab, logistics_tab, budget_tab, tips_tab, extras_tab = st.tabs([
-                    "🌟 Overview", "📅 Itinerary", "✈️ Travel & Stay", "💰 Budget", "📝 Local Tips", "✨ Extras"
-                ])
+                with col1:
+                    st.markdown(f"""
+                    #### 🎯 Trip Summary
+                    - **Style**: {travel_style}
+                    - **Duration**: {duration} days
+                    - **Travel Persona**: {travel_persona}
+                    - **Pace**: {pace_preference}
+                    """)
                 
-                with overview_tab:
-                    st.markdown("### 🌟 Trip Overview")
-                    col1, col2, col3 = st.columns([2,1,1])
-                    
-                    with col1:
-                        st.markdown(f"""
-                        #### 🎯 Trip Summary
-                        - **Style**: {travel_style}
-                        - **Duration**: {duration} days
-                        - **Travel Persona**: {travel_persona}
-                        - **Pace**: {pace_preference}
-                        """)
-                    
-                    with col2:
-                        st.markdown(f"""
-                        #### 🎨 Interests
-                        {', '.join([f'• {i}' for i in interests])}
-                        """)
-                    
-                    with col3:
-                        st.markdown(f"""
-                        #### 📍 Key Details
-                        - From: {source_city}
-                        - To: {destination_city}
-                        - When: {departure_date}
-                        """)
-                    st.divider()
-                    st.markdown("### 💎 Special Experiences")
-                    st.markdown(experiences_out)
-
-                with plan_tab:
-                    st.markdown("### 📅 Day-by-Day Itinerary")
-                    st.info("💡 Here is your detailed, day-by-day plan.")
-                    st.markdown(plan_out)
+                with col2:
+                    st.markdown(f"""
+                    #### 🎨 Interests
+                    {', '.join([f'• {i}' for i in interests])}
+                    """)
                 
-                with logistics_tab:
-                    st.markdown("### ✈️ Travel & Accommodation Details")
-                    st.markdown(logistics_out)
+                with col3:
+                    st.markdown(f"""
+                    #### 📍 Key Details
+                    - From: {source_city}
+                    - To: {destination_city}
+                    - When: {departure_date}
+                    """)
+                st.divider()
+                st.markdown("### 💎 Special Experiences")
+                overview_experiences_slot = st.empty()
+
+            with plan_tab:
+                st.markdown("### 📅 Day-by-Day Itinerary")
+                st.info("💡 Here is your detailed, day-by-day plan.")
+                plan_slot = st.empty()
+            
+            with logistics_tab:
+                st.markdown("### ✈️ Travel & Accommodation Details")
+                logistics_slot = st.empty()
+                    
+            with budget_tab:
+                st.markdown("### 💰 Budget Breakdown")
+                budget_slot = st.empty()
+            
+            with tips_tab:
+                st.markdown("### 📝 Local Insights & Tips")
+                insights_slot = st.empty()
                         
-                with budget_tab:
-                    st.markdown("### 💰 Budget Breakdown")
-                    st.markdown(budget_out)
-                
-                with tips_tab:
-                    st.markdown("### 📝 Local Insights & Tips")
-                    st.markdown(insights_out)
-                            
-                with extras_tab:
-                    st.markdown("### ✨ Special Experiences")
-                    st.markdown(experiences_out)
-                
-                # Combine all parts for the download file
-                full_itinerary = f"""
-TRIP PLAN FOR {destination_city.upper()}
-================================
-LOGISTICS
-{logistics_out}
-================================
-BUDGET
-{budget_out}
-================================
-ITINERARY
-{plan_out}
-================================
-LOCAL INSIGHTS
-{insights_out}
-================================
-EXPERIENCES
-{experiences_out}
-"""
-                
-                # Download button for the complete plan
-                st.download_button(
-                    label="📥 Download Complete Travel Plan",
-                    data=full_itinerary,
-                    file_name=f"travel_plan_{destination_city}_{departure_date}.txt",
-                    mime="text/plain"
+            with extras_tab:
+                st.markdown("### ✨ Special Experiences")
+                extras_slot = st.empty()
+
+            # Each task fills its section(s) the moment it finishes
+            task_slots = {
+                "logistics": [logistics_slot],
+                "budget": [budget_slot],
+                "planning": [plan_slot],
+                "local_insights": [insights_slot],
+                "experiences": [overview_experiences_slot, extras_slot],
+            }
+            for slots in task_slots.values():
+                for slot in slots:
+                    slot.info("⏳ Still working on this section...")
+
+            task_outputs = {}
+            for name, output, final in trip_crew.events():
+                # Partial outputs, e.g. the first days of a long itinerary, are shown as they arrive
+                for slot in task_slots[name]:
+                    slot.markdown(plan_schema.render(name, output.raw))
+                if not final:
+                    continue
+                task_outputs[name] = output
+                progress.progress(
+                    len(task_outputs) / len(task_slots),
+                    text=f"🔄 {len(task_outputs)} of {len(task_slots)} sections ready..."
                 )
+
+            st.session_state["last_trip"] = planner.TripResult(inputs, task_outputs, trip_crew.failed)
+            sections = {name: output.raw for name, output in task_outputs.items()}
+            history.record(inputs, sections, trip_crew.failed, session=SESSION_ID)
+
+            progress.empty()
+            if trip_crew.failed:
+                st.warning(
+                    f"⚠️ {len(trip_crew.failed)} section(s) could not be generated right now: "
+                    f"{', '.join(trip_crew.failed)}. Submit again to retry only those."
+                )
+            else:
+                st.success("✨ Your comprehensive travel plan is ready!")
+
+            if show_debug:
+                with st.expander("🔧 Performance debug", expanded=True):
+                    stats = [trip_crew.stats[name].as_dict() for name in task_slots if name in trip_crew.stats]
+                    st.dataframe(stats, use_container_width=True)
+                    st.caption(
+                        f"Total LLM time {sum(s['llm_seconds'] for s in stats):.1f}s, "
+                        f"~{sum(s['prompt_tokens'] + s['completion_tokens'] for s in stats)} tokens "
+                        f"({sum(s['cached_prompt_tokens'] for s in stats)} prompt tokens cached), "
+                        f"est. ${sum(s['cost'] for s in stats):.4f}"
+                    )
+            
+            # Download button for the complete plan
+            st.download_button(
+                label="📥 Download Complete Travel Plan",
+                data=plan_download(plan_schema.render, destination_city, sections),
+                file_name=f"travel_plan_{destination_city}_{departure_date}.txt",
+                mime="text/plain"
+            )
                 
         except Exception as e:
             st.error(f"❌ An error occurred: {str(e)}")
-            st.error("Please check your GOOGLE_API_KEY in the .env file and ensure you have internet access.")
\ No newline at end of file
+            st.error("Please check your GOOGLE_API_KEY in the .env file and ensure you have internet access.")
+elif "history_plan" in st.session_state:
+    saved_plan = history.load(st.session_state["history_plan"])
+    if saved_plan is None:
+        st.info("That plan is no longer in your history.")
+    else:
+        show_saved_plan(saved_plan)
@@ -0,0 +1,142 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from plan_schema import to_data
+from task_cache import normalize
+from trip_agents import TripCrew, TASK_ORDER   # import AFTER .env is loaded
+
+
+class RowRateLimiter:
+    # Spaces row starts evenly so a batch never exceeds `per_minute` crews a minute
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+def read_rows(path):
+    # Each line is either a bare inputs dict or {"request_id": ..., "inputs": {...}}
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            inputs = row.get("inputs", row)
+            row_id = str(row.get("request_id", line_no))
+            yield row_id, inputs
+
+
+def finished_ids(path):
+    if not path.exists():
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if record.get("status") == "done":
+                done.add(record["request_id"])
+    return done
+
+
+def drop_torn_line(path):
+    # Cuts a line left half-written by a crash, so the next record appended
+    # starts on a line of its own instead of being glued onto it
+    if not path.exists():
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, 2)
+        position = end
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+def plan_row(row_id, inputs, limiter):
+    limiter.wait()
+    started = time.time()
+    try:
+        result = TripCrew(inputs).kickoff()
+    except Exception as e:
+        return {"request_id": row_id, "status": "failed", "error": str(e)}
+    # Rows with failed sections are "partial" and get planned again on resume
+    return {
+        "request_id": row_id,
+        "status": "partial" if result.failed else "done",
+        "failed_sections": result.failed,
+        "inputs": inputs,
+        "sections": {name: to_data(name, result.outputs[name].raw) for name in TASK_ORDER},
+        "seconds": round(time.time() - started, 3),
+    }
+
+
+def run_batch(input_path, output_path, concurrency=4, rpm=None):
+    output_path = Path(output_path)
+    done = finished_ids(output_path)
+    rows = [(row_id, inputs) for row_id, inputs in read_rows(input_path) if row_id not in done]
+    # The first row for each destination is queued ahead of the repeats, so the
+    # repeats usually find its destination-only tasks already in the task cache
+    seen = set()
+    leaders, repeats = [], []
+    for row in rows:
+        destination = normalize(row[1].get("destination_city", ""))
+        (repeats if destination in seen else leaders).append(row)
+        seen.add(destination)
+    rows = leaders + repeats
+    print(f"{len(done)} rows already finished, {len(rows)} to plan", file=sys.stderr)
+
+    limiter = RowRateLimiter(rpm)
+    failed = 0
+    drop_torn_line(output_path)
+    with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(plan_row, row_id, inputs, limiter) for row_id, inputs in rows]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if record["status"] != "done":
+                failed += 1
+            print(f"{record['request_id']}: {record['status']}", file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan every trip in a JSONL file of TripCrew inputs")
+    parser.add_argument("input", help="JSONL file, one inputs dict (or {request_id, inputs}) per line")
+    parser.add_argument("-o", "--output", help="JSONL results file, appended to and used to resume")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="crews to run at once")
+    parser.add_argument("--rpm", type=float, help="maximum rows started per minute")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.input).with_suffix(".results.jsonl"))
+    failed = run_batch(args.input, output, args.concurrency, args.rpm)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from llm_backends import FakeLLM
+from rate_limit import llm_limiter
+from task_cache import TaskCache
+from trip_agents import TripCrew, TASK_ORDER
+
+DURATIONS = [1, 7, 14, 30]
+INTEREST_SETS = {
+    "culture_food": ["Culture", "Food"],
+    "adventure": ["Adventure", "Nature", "Sports"],
+    "everything": ["Culture", "Food", "Nature", "Shopping", "History", "Art", "Music", "Photography"],
+}
+
+# Mirrors the inputs dict app.py builds from the form defaults
+BASE_INPUTS = {
+    "source_city": "New York",
+    "destination_city": "Paris",
+    "travel_date": "2026-06-15",
+    "duration": 7,
+    "preferred_time": "Morning",
+    "interests": ["Culture", "Food"],
+    "budget": "Moderate",
+    "weather_preference": "Mild",
+    "location_preference": "City Center",
+    "special_requirements": "None",
+    "accessibility_needs": ["None"],
+    "dietary_restrictions": ["None"],
+    "medical_needs": "",
+    "language_preference": ["English Only"],
+    "include_shopping": False,
+    "include_nightlife": False,
+    "include_photography": False,
+    "include_work_spaces": False,
+    "include_local_events": False,
+    "include_wellness": False,
+    "include_cooking": False,
+    "include_workshops": False,
+    "include_volunteering": False,
+    "travel_style": "Solo Adventure",
+    "pace_preference": "Moderate",
+}
+
+
+# Time budgets for the Streamlit script itself, checked by --startup
+COLD_START_BUDGET = 1.0
+RERUN_BUDGET = 0.15
+
+# Runs app.py in a fresh interpreter, so the first run really is a cold start
+STARTUP_SCRIPT = """
+import json, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=60)
+started = time.perf_counter()
+at.run()
+cold = time.perf_counter() - started
+reruns = []
+for _ in range({reruns}):
+    started = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - started)
+print(json.dumps({{"cold": cold, "reruns": reruns, "errors": [str(e.value) for e in at.exception]}}))
+"""
+
+
+def measure_startup(reruns=10):
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    proc = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT.format(app=app, reruns=reruns)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def check_startup(cold_budget=COLD_START_BUDGET, rerun_budget=RERUN_BUDGET, reruns=10):
+    # Returns True when app.py's cold start and median rerun are within budget
+    result = measure_startup(reruns)
+    rerun = statistics.median(result["reruns"])
+    print(f"cold start {result['cold'] * 1000:.0f} ms (budget {cold_budget * 1000:.0f} ms), "
+          f"median rerun {rerun * 1000:.0f} ms (budget {rerun_budget * 1000:.0f} ms)", file=sys.stderr)
+    for error in result["errors"]:
+        print(f"app.py raised: {error}", file=sys.stderr)
+    return not result["errors"] and result["cold"] <= cold_budget and rerun <= rerun_budget
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile; good enough for latency reports
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def run_scenario(inputs, runs, llm, warm_cache=False):
+    cache = TaskCache(path=":memory:")
+    construct, end_to_end = [], []
+    per_task = {name: [] for name in TASK_ORDER}
+
+    tracemalloc.start()
+    for _ in range(runs):
+        if not warm_cache:
+            cache.clear()
+        started = time.perf_counter()
+        crew = TripCrew(inputs, cache=cache, llm=llm)
+        built = time.perf_counter()
+        crew.kickoff()
+        finished = time.perf_counter()
+
+        construct.append(built - started)
+        end_to_end.append(finished - started)
+        for name, stats in crew.stats.items():
+            per_task[name].append(stats.wall_seconds)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "construct_ms": statistics.mean(construct) * 1000,
+        "task_ms": {name: statistics.mean(times) * 1000 for name, times in per_task.items() if times},
+        "p50_ms": percentile(end_to_end, 50) * 1000,
+        "p95_ms": percentile(end_to_end, 95) * 1000,
+        "p99_ms": percentile(end_to_end, 99) * 1000,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TripCrew end to end against the offline fake LLM")
+    parser.add_argument("--runs", type=int, default=5, help="kickoffs per scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random seconds per call")
+    parser.add_argument("--tokens", type=int, default=300, help="fake completion length in words")
+    parser.add_argument("--durations", type=int, nargs="+", default=DURATIONS)
+    parser.add_argument("--warm-cache", action="store_true", help="keep the task cache between runs")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--startup", action="store_true",
+                        help="only check app.py's cold start and rerun time; exits 1 over budget")
+    parser.add_argument("--cold-budget", type=float, default=COLD_START_BUDGET)
+    parser.add_argument("--rerun-budget", type=float, default=RERUN_BUDGET)
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        sys.exit(0 if check_startup(args.cold_budget, args.rerun_budget) else 1)
+
+    llm = FakeLLM(
+        model="fake/benchmark",
+        latency=args.latency,
+        jitter=args.jitter,
+        completion_tokens=args.tokens,
+        seed=0,
+    )
+    # The fake model has no quota; left at TRIP_LLM_RPS the limiter, not the
+    # crew, would set the numbers
+    llm_limiter.max_rate = llm_limiter.rate = 1e9
+    llm_limiter.burst = llm_limiter.tokens = max(llm_limiter.burst, 1000000)
+
+    results = []
+    for duration in args.durations:
+        for interests_name, interests in INTEREST_SETS.items():
+            inputs = dict(BASE_INPUTS, duration=duration, interests=interests)
+            stats = run_scenario(inputs, args.runs, llm, args.warm_cache)
+            stats.update(duration=duration, interests=interests_name)
+            results.append(stats)
+
+    header = f"{'days':>4} {'interests':<13} {'build ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak MB':>8}  slowest task"
+    print(header, file=sys.stderr)
+    for r in results:
+        slowest = max(r["task_ms"], key=r["task_ms"].get)
+        print(
+            f"{r['duration']:>4} {r['interests']:<13} {r['construct_ms']:>9.1f} {r['p50_ms']:>8.0f} "
+            f"{r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['peak_mb']:>8.1f}  {slowest} ({r['task_ms'][slowest]:.0f} ms)",
+            file=sys.stderr,
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
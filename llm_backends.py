@@ -0,0 +1,257 @@
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from crewai import BaseLLM, LLM
+from pydantic import PrivateAttr
+
+GEMINI_MODEL = "gemini/gemini-2.0-flash-exp"
+
+# "gemini" talks to Google; "fake" answers locally for benchmarks and offline runs
+LLM_BACKEND = os.getenv("TRIP_LLM_BACKEND", "gemini")
+
+_WORDS = (
+    "museum market harbour old town cathedral gallery tram station riverside garden "
+    "viewpoint bistro tasting menu street food bakery night market ferry walking tour "
+    "hotel boutique hostel suite breakfast transfer airport taxi metro pass budget "
+    "morning afternoon evening sunset local guide reservation ticket price euro"
+).split()
+
+
+# plan_schema.output_format() asks for JSON with this phrase before an example
+# of the shape; FakeLLM answers such prompts with JSON of that shape
+_JSON_SHAPE_MARKER = "JSON object shaped like "
+
+# Task prompts put everything that is the same for every request first (the
+# agent, the instructions, the output shape) and the request's own values
+# after this line, so providers can serve the prefix from their prompt cache
+PROMPT_DETAILS_MARKER = "Trip details:"
+
+# FakeLLM's simulated prompt cache matches prefixes in blocks of this many tokens
+CACHE_BLOCK_TOKENS = 64
+CACHE_MAX_PREFIXES = 100000
+CONTEXT_CACHE_TTL = 3600
+
+# Usage a backend reports for the call just made on this thread, read by
+# metrics.MeteredLLM. Backends that report nothing are estimated from the text.
+_call_usage = threading.local()
+
+
+def report_call_usage(**usage):
+    _call_usage.value = usage
+
+
+def pop_call_usage():
+    usage = getattr(_call_usage, "value", None)
+    _call_usage.value = None
+    return usage or {}
+
+
+def _fill_shape(shape, rng):
+    if isinstance(shape, dict):
+        return {key: _fill_shape(value, rng) for key, value in shape.items()}
+    if isinstance(shape, list):
+        if len(shape) == 1:
+            return [_fill_shape(shape[0], rng) for _ in range(rng.randint(2, 3))]
+        return [_fill_shape(item, rng) for item in shape]
+    if isinstance(shape, float):
+        return float(rng.randint(50, 1500))
+    if isinstance(shape, int):
+        return shape
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 10)))
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token, the usual rule of thumb for English
+    return max(1, len(text) // 4)
+
+
+def prompt_text(messages):
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+def static_prefix(prompt):
+    # The part of a prompt that is the same for every request, or None
+    at = prompt.find(PROMPT_DETAILS_MARKER)
+    return prompt[:at + len(PROMPT_DETAILS_MARKER)] if at >= 0 else None
+
+
+class FakeLLM(BaseLLM):
+    # Deterministic stand-in for a real model: the same prompt and seed always
+    # give the same answer, after a configurable delay.
+    #
+    # It also simulates provider prompt caching. Prompt prefixes it has seen
+    # before, matched in blocks of CACHE_BLOCK_TOKENS, count as cached and
+    # skip the prefill delay. With context_cache, the static prefix of each
+    # prompt also gets an explicit cache handle on first use, which later
+    # calls are served from.
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    completion_tokens: int = 300
+    responses: dict = {}
+    prefix_cache: bool = True
+    context_cache: bool = False
+    # Extra seconds per 1000 prompt tokens not served from the cache
+    prefill_per_1k_tokens: float = 0.0
+
+    _usage: dict = PrivateAttr(default_factory=lambda: {
+        "calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+        "cache_creation_tokens": 0, "completion_tokens": 0,
+    })
+    _usage_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _prefixes: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    # static prefix digest -> (handle, expires at)
+    _handles: dict = PrivateAttr(default_factory=dict)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        prompt = prompt_text(messages)
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()
+        rng = random.Random(digest)
+        prompt_tokens = estimate_tokens(prompt)
+        cached, created = self._cached_tokens(prompt)
+        cached = min(cached, prompt_tokens)
+        time.sleep(
+            self.latency + rng.uniform(0, self.jitter)
+            + (prompt_tokens - cached) / 1000 * self.prefill_per_1k_tokens
+        )
+
+        answer = next((text for marker, text in self.responses.items() if marker in prompt), None)
+        shape_at = prompt.rfind(_JSON_SHAPE_MARKER)
+        if answer is None and shape_at >= 0:
+            try:
+                shape, _ = json.JSONDecoder().raw_decode(prompt, shape_at + len(_JSON_SHAPE_MARKER))
+                answer = json.dumps(_fill_shape(shape, rng))
+            except ValueError:
+                pass
+        if answer is None:
+            answer = " ".join(rng.choice(_WORDS) for _ in range(self.completion_tokens))
+
+        completion_tokens = estimate_tokens(answer)
+        with self._usage_lock:
+            self._usage["calls"] += 1
+            self._usage["prompt_tokens"] += prompt_tokens
+            self._usage["cached_prompt_tokens"] += cached
+            self._usage["cache_creation_tokens"] += created
+            self._usage["completion_tokens"] += completion_tokens
+        report_call_usage(
+            prompt_tokens=prompt_tokens, cached_prompt_tokens=cached, completion_tokens=completion_tokens
+        )
+        return f"Thought: I now know the final answer\nFinal Answer: {answer}"
+
+    def _cached_tokens(self, prompt):
+        # Returns (prompt tokens served from the cache, tokens written to a new handle)
+        cached = created = 0
+        if self.prefix_cache:
+            block = CACHE_BLOCK_TOKENS * 4
+            running = hashlib.blake2b(digest_size=16)
+            keys = []
+            for start in range(0, len(prompt) - block + 1, block):
+                running.update(prompt[start:start + block].encode("utf-8"))
+                keys.append(running.copy().digest())
+            with self._usage_lock:
+                for key in keys:
+                    if key not in self._prefixes:
+                        break
+                    cached += CACHE_BLOCK_TOKENS
+                for key in keys:
+                    self._prefixes[key] = None
+                    self._prefixes.move_to_end(key)
+                while len(self._prefixes) > CACHE_MAX_PREFIXES:
+                    self._prefixes.popitem(last=False)
+
+        prefix = static_prefix(prompt) if self.context_cache else None
+        if prefix is not None:
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+            now = time.monotonic()
+            with self._usage_lock:
+                handle = self._handles.get(key)
+                if handle is None or handle[1] <= now:
+                    self._handles[key] = (f"cachedContents/fake-{key[:16]}", now + CONTEXT_CACHE_TTL)
+                    created = estimate_tokens(prefix)
+                else:
+                    cached = max(cached, estimate_tokens(prefix))
+        return cached, created
+
+    def usage(self):
+        with self._usage_lock:
+            return dict(self._usage, context_handles=len(self._handles))
+
+    def supports_function_calling(self):
+        return False
+
+    def get_context_window_size(self):
+        return 1_000_000
+
+
+def create_llm(backend=None, api_key=None, model=GEMINI_MODEL):
+    backend = backend or LLM_BACKEND
+    if backend == "fake":
+        return FakeLLM(
+            model=f"fake/{model.split('/')[-1]}",
+            latency=float(os.getenv("TRIP_FAKE_LATENCY", "0.5")),
+            jitter=float(os.getenv("TRIP_FAKE_JITTER", "0.2")),
+            seed=int(os.getenv("TRIP_FAKE_SEED", "0")),
+            prefill_per_1k_tokens=float(os.getenv("TRIP_FAKE_PREFILL", "0")),
+            context_cache=os.getenv("TRIP_FAKE_CONTEXT_CACHE", "0").lower() in ("1", "true", "yes"),
+        )
+    if backend != "gemini":
+        raise ValueError(f"Unknown LLM backend: {backend}")
+
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    gemini = _gemini_llm_class()
+    if gemini is None:
+        return LLM(
+            model=model,
+            temperature=0.7,
+            api_key=api_key
+        )
+    return gemini(model=model.partition("/")[2], provider="gemini", temperature=0.7, api_key=api_key)
+
+
+@functools.lru_cache(maxsize=None)
+def _gemini_llm_class():
+    # crewai's native Gemini client, which needs google-genai; without it
+    # crewai goes through LiteLLM and cached tokens are not reported
+    try:
+        from crewai.llms.providers.gemini.completion import GeminiCompletion
+    except ImportError:
+        return None
+    from crewai.llms.base_llm import UsageMetrics
+
+    class GeminiLLM(GeminiCompletion):
+        # Reports each call's usage, including the prompt tokens Gemini served
+        # from its prefix cache (cached_content_token_count)
+
+        def _track_token_usage_internal(self, usage_data):
+            super()._track_token_usage_internal(usage_data)
+            usage = UsageMetrics.from_provider_dict(usage_data)
+            if usage is not None:
+                report_call_usage(
+                    prompt_tokens=usage.prompt_tokens,
+                    cached_prompt_tokens=usage.cached_prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                )
+
+    return GeminiLLM
+
+
+_shared_llms = {}
+_shared_llm_lock = threading.Lock()
+
+
+def shared_llm(model=GEMINI_MODEL):
+    # One client per model per process, so every crew reuses the provider's pooled HTTP connections
+    with _shared_llm_lock:
+        if model not in _shared_llms:
+            _shared_llms[model] = create_llm(model=model)
+        return _shared_llms[model]
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+
+# crewai's trace-sharing prompt waits about 5 s per task in a process with no
+# terminal, which would swamp the planner's own latency
+os.environ.setdefault("CREWAI_TRACING_ENABLED", "false")
+
+from benchmark import BASE_INPUTS, percentile
+from llm_backends import FakeLLM
+from prewarm import POPULAR_DESTINATIONS
+from rate_limit import llm_limiter
+from similar_plans import PlanIndex
+from task_cache import TaskCache
+from trip_agents import TripCrew
+
+USER_STEPS = [1, 2, 4, 8, 16, 32]
+
+# Form values as users pick them: weighted choices, or ranges for numbers
+DURATIONS = [(3, 15), (5, 20), (7, 30), (10, 15), (14, 15), (21, 5)]
+BUDGETS = [("Budget", 30), ("Moderate", 50), ("Luxury", 20)]
+PACES = [("Relaxed", 30), ("Moderate", 50), ("Fast-paced", 20)]
+TRAVEL_STYLES = [
+    ("Solo Adventure", 30), ("Couple's Getaway", 30), ("Family Trip", 20),
+    ("Friends' Adventure", 15), ("Business & Leisure", 5),
+]
+INTERESTS = [
+    "Culture", "Food", "Nature", "Shopping", "History", "Adventure", "Art", "Music",
+    "Architecture", "Sports", "Relaxation", "Photography", "Local Experiences",
+    "Festivals", "Wellness", "Technology",
+]
+SOURCE_CITIES = ["New York", "London", "Berlin", "Toronto", "Sydney", "Singapore", "Mumbai", "São Paulo"]
+# Share of requests for a destination outside the popular list
+LONG_TAIL_SHARE = 0.3
+
+# A step is saturated once adding users raises throughput by less than this
+SATURATION_GAIN = 0.1
+
+
+def weighted(rng, options):
+    values, weights = zip(*options)
+    return rng.choices(values, weights)[0]
+
+
+def synthetic_inputs(rng):
+    # One form submission. Popular destinations follow a Zipf-like curve, so
+    # some requests share cached tasks the way real traffic does.
+    if rng.random() < LONG_TAIL_SHARE:
+        destination = f"Town {rng.randrange(100000)}"
+    else:
+        ranks = range(1, len(POPULAR_DESTINATIONS) + 1)
+        destination = rng.choices(POPULAR_DESTINATIONS, [1 / rank for rank in ranks])[0]
+    interests = rng.sample(INTERESTS, rng.choice([1, 2, 2, 3, 3, 4]))
+    return dict(
+        BASE_INPUTS,
+        source_city=rng.choice(SOURCE_CITIES),
+        destination_city=destination,
+        travel_date=(date.today() + timedelta(days=rng.randrange(7, 365))).isoformat(),
+        duration=weighted(rng, DURATIONS),
+        interests=interests,
+        budget=weighted(rng, BUDGETS),
+        pace_preference=weighted(rng, PACES),
+        travel_style=weighted(rng, TRAVEL_STYLES),
+        include_photography=rng.random() < 0.2,
+        include_cooking=rng.random() < 0.2,
+        include_nightlife=rng.random() < 0.2,
+        include_wellness=rng.random() < 0.1,
+    )
+
+
+def rss_mb():
+    # Resident memory of this process now, from /proc where available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class CrewTarget:
+    # Plans in this process the way app.py's submit path does: a TripCrew per
+    # session, with its events consumed as they arrive
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def begin_step(self):
+        # Every step starts from empty caches, so steps are comparable
+        self.cache = TaskCache(path=":memory:")
+        self.similar = PlanIndex()
+
+    def plan(self, inputs):
+        # Returns (queue seconds, failed sections). Tasks run in parallel, so a
+        # plan waited as long as its longest-waiting task: for a worker, for LLM
+        # quota, or on an identical plan another user had in flight.
+        crew = TripCrew(inputs, cache=self.cache, llm=self.llm, similar=self.similar)
+        for _ in crew.events():
+            pass
+        queued = max((stats.queue_seconds + stats.wait_seconds for stats in crew.stats.values()), default=0.0)
+        return queued, len(crew.failed)
+
+    def llm_calls(self):
+        return self.llm.usage()["calls"]
+
+
+class HttpTarget:
+    # Plans through a running server.py: POST /plans, then poll the job
+
+    def __init__(self, url, poll=0.1):
+        self.url = url.rstrip("/")
+        self.poll = poll
+
+    def begin_step(self):
+        pass
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read())
+
+    def plan(self, inputs):
+        job = self._request("/plans", inputs)
+        while True:
+            summary = self._request(job["status_url"])
+            if summary["status"] in ("done", "failed"):
+                break
+            time.sleep(self.poll)
+        if summary["status"] == "failed":
+            raise RuntimeError(summary["error"])
+        return summary["started_at"] - summary["submitted_at"], len(summary["failed_sections"])
+
+    def llm_calls(self):
+        return None
+
+
+def run_step(target, users, seconds, think, seed):
+    # Closed loop: each user submits, waits for the plan, thinks, and repeats
+    # until the step's time is up. Plans in flight at that point still finish.
+    target.begin_step()
+    latencies, queued, errors, partial = [], [], [], 0
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+    calls_before = target.llm_calls()
+
+    def user(index):
+        nonlocal partial
+        rng = random.Random(seed * 1000003 + index)
+        while time.perf_counter() < stop_at:
+            inputs = synthetic_inputs(rng)
+            started = time.perf_counter()
+            try:
+                queue_seconds, failed = target.plan(inputs)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            else:
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    queued.append(queue_seconds)
+                    partial += bool(failed)
+            time.sleep(rng.expovariate(1 / think) if think else 0)
+
+    samples = {"threads": [], "rss": []}
+    done = threading.Event()
+
+    def monitor():
+        while not done.wait(0.1):
+            samples["threads"].append(threading.active_count())
+            samples["rss"].append(rss_mb())
+
+    watcher = threading.Thread(target=monitor, daemon=True)
+    watcher.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    watcher.join()
+
+    calls = target.llm_calls()
+    plans = len(latencies)
+    return {
+        "users": users,
+        "plans": plans,
+        "errors": len(errors),
+        "partial": partial,
+        "error_rate": len(errors) / max(1, plans + len(errors)),
+        "throughput": plans / elapsed,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "queue_mean_s": statistics.mean(queued) if queued else 0.0,
+        "queue_p95_s": percentile(queued, 95),
+        "llm_calls_per_plan": (calls - calls_before) / plans if calls is not None and plans else None,
+        "peak_threads": max(samples["threads"], default=threading.active_count()),
+        "peak_rss_mb": max(samples["rss"], default=rss_mb()),
+        "sample_errors": errors[:3],
+    }
+
+
+def saturation_point(steps):
+    # The last step whose extra users still raised throughput meaningfully;
+    # None if throughput was still growing at the largest step
+    for previous, step in zip(steps, steps[1:]):
+        if step["throughput"] < previous["throughput"] * (1 + SATURATION_GAIN):
+            return previous
+    return None
+
+
+def check_gates(steps, saturated, args):
+    failures = []
+    for step in steps:
+        if step["error_rate"] > args.max_error_rate:
+            failures.append(f"{step['users']} users: error rate {step['error_rate']:.1%} > {args.max_error_rate:.1%}")
+    gate = next((s for s in steps if s["users"] == args.gate_users), steps[-1])
+    if args.max_p95 is not None and gate["p95_s"] > args.max_p95:
+        failures.append(f"{gate['users']} users: p95 {gate['p95_s']:.2f}s > {args.max_p95:.2f}s")
+    if args.min_throughput is not None and gate["throughput"] < args.min_throughput:
+        failures.append(f"{gate['users']} users: {gate['throughput']:.2f} plans/s < {args.min_throughput:.2f}")
+    if args.min_saturation_users is not None and saturated is not None and saturated["users"] < args.min_saturation_users:
+        failures.append(f"saturated at {saturated['users']} users < {args.min_saturation_users}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the planner with concurrent synthetic users")
+    parser.add_argument("--users", type=int, nargs="+", default=USER_STEPS, help="concurrent users, one step each")
+    parser.add_argument("--seconds", type=float, default=10, help="length of each step")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds a user waits between plans")
+    parser.add_argument("--url", help="drive a running server.py at this URL instead of TripCrew in process")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random seconds per call")
+    parser.add_argument("--llm-rps", type=float, default=0,
+                        help="process-wide LLM requests per second (0: unlimited, to measure the planner alone)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    gates = parser.add_argument_group("CI gates (exit 1 when one fails)")
+    gates.add_argument("--max-error-rate", type=float, default=0.01, help="at every step")
+    gates.add_argument("--gate-users", type=int, help="step the p95 and throughput gates apply to (default: largest)")
+    gates.add_argument("--max-p95", type=float, help="seconds")
+    gates.add_argument("--min-throughput", type=float, help="plans per second")
+    gates.add_argument("--min-saturation-users", type=int, help="fail if throughput stops growing before this many users")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        llm = FakeLLM(model="fake/loadtest", latency=args.latency, jitter=args.jitter, seed=args.seed)
+        target = CrewTarget(llm)
+        rate = args.llm_rps or 1e9
+        llm_limiter.max_rate = llm_limiter.rate = rate
+        llm_limiter.burst = llm_limiter.tokens = max(llm_limiter.burst, int(min(rate, 1e6)))
+
+    steps = []
+    print(f"{'users':>5} {'plans':>6} {'plans/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'queue s':>8} {'calls':>6} {'threads':>8} {'RSS MB':>7} {'errors':>6}", file=sys.stderr)
+    for users in sorted(set(args.users)):
+        step = run_step(target, users, args.seconds, args.think, args.seed)
+        steps.append(step)
+        calls = f"{step['llm_calls_per_plan']:.1f}" if step["llm_calls_per_plan"] is not None else "-"
+        print(f"{users:>5} {step['plans']:>6} {step['throughput']:>8.2f} {step['p50_s']:>7.2f} {step['p95_s']:>7.2f} "
+              f"{step['p99_s']:>7.2f} {step['queue_mean_s']:>8.3f} {calls:>6} {step['peak_threads']:>8} "
+              f"{step['peak_rss_mb']:>7.0f} {step['errors']:>6}", file=sys.stderr)
+        for error in step["sample_errors"]:
+            print(f"  error: {error}", file=sys.stderr)
+
+    saturated = saturation_point(steps)
+    if saturated is None:
+        print(f"throughput still rising at {steps[-1]['users']} users", file=sys.stderr)
+    else:
+        print(f"saturation at {saturated['users']} users, {saturated['throughput']:.2f} plans/s, "
+              f"p95 {saturated['p95_s']:.2f}s", file=sys.stderr)
+
+    failures = check_gates(steps, saturated, args)
+    for failure in failures:
+        print(f"gate failed: {failure}", file=sys.stderr)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"steps": steps, "saturation_users": saturated and saturated["users"],
+                       "gate_failures": failures}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
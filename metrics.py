@@ -0,0 +1,294 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from crewai import BaseLLM
+
+from llm_backends import estimate_tokens, pop_call_usage, prompt_text
+
+logger = logging.getLogger("trip_planner.metrics")
+
+# Estimated USD per million (input, output) tokens, matched against the model name
+MODEL_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "fake": (0.0, 0.0),
+}
+
+# Share of the input price charged for prompt tokens served from the provider's cache
+CACHED_INPUT_PRICE_RATIO = 0.25
+
+TASK_SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+    matches = [name for name in MODEL_PRICES if name in model]
+    if not matches:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    uncached = prompt_tokens - cached_prompt_tokens
+    input_cost = (uncached + cached_prompt_tokens * CACHED_INPUT_PRICE_RATIO) * input_price
+    return (input_cost + completion_tokens * output_price) / 1_000_000
+
+
+class TaskStats:
+    # What one task of one crew run cost; shown in app.py's debug panel
+
+    def __init__(self, name):
+        self.name = name
+        self.queue_seconds = 0.0
+        # Time spent waiting for LLM quota or on an identical in-flight run.
+        # Itinerary chunks and hedged calls wait side by side, so this is the
+        # length of the union of their wait intervals, not their sum.
+        self.wait_seconds = 0.0
+        self._waits = []
+        self._waits_lock = threading.Lock()
+        self.wall_seconds = 0.0
+        self.cached = False
+        # Waited on an identical in-flight run instead of calling the LLM
+        self.shared = False
+        # Similarity of the near-duplicate stored plan reused instead of calling the LLM
+        self.similar = None
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.prompt_tokens = 0
+        # The part of prompt_tokens the provider served from its prompt cache
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.errors = 0
+        self.retries = 0
+        self.cost = 0.0
+        self.failed = None
+
+    def add_wait(self, started, ended):
+        with self._waits_lock:
+            self._waits.append((started, ended))
+            total, covered = 0.0, None
+            for start, end in sorted(self._waits):
+                if covered is not None and start < covered:
+                    start = covered
+                if end > start:
+                    total += end - start
+                    covered = end
+            self.wait_seconds = total
+
+    def as_dict(self):
+        return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name, labels, value, buckets=TASK_SECONDS_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.setdefault(key, {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0, "le": buckets})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def render_prometheus(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                for bound, count in zip(hist["le"], hist["buckets"]):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{fmt(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = MetricsRegistry()
+
+# The TaskStats of the task running in this thread, so LLM calls can be
+# attributed to it. Thread pools that run task work must copy the context.
+_current_task = contextvars.ContextVar("trip_current_task", default=None)
+
+
+@contextmanager
+def task_scope(stats):
+    token = _current_task.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_task.reset(token)
+
+
+def current_task_name():
+    stats = _current_task.get()
+    return stats.name if stats is not None else None
+
+
+def record_task(stats):
+    labels = {"task": stats.name}
+    registry.inc("trip_task_runs_total", dict(
+        labels,
+        cached=str(stats.cached).lower(),
+        shared=str(stats.shared).lower(),
+        similar=str(stats.similar is not None).lower(),
+    ))
+    registry.observe("trip_task_seconds", labels, stats.wall_seconds)
+    registry.inc("trip_task_queue_seconds_total", labels, stats.queue_seconds)
+    registry.inc("trip_task_wait_seconds_total", labels, stats.wait_seconds)
+    logger.info(json.dumps(dict(stats.as_dict(), event="task")))
+
+
+def record_llm_call(model, seconds, prompt_tokens, completion_tokens, error=None, cached_prompt_tokens=0):
+    stats = _current_task.get()
+    task = stats.name if stats is not None else "unknown"
+    labels = {"task": task, "model": model}
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_prompt_tokens)
+
+    if error is not None:
+        registry.inc("trip_llm_errors_total", dict(labels, kind=error))
+    else:
+        registry.inc("trip_llm_calls_total", labels)
+        registry.inc("trip_llm_prompt_tokens_total", labels, prompt_tokens)
+        registry.inc("trip_llm_cached_prompt_tokens_total", labels, cached_prompt_tokens)
+        registry.inc("trip_llm_completion_tokens_total", labels, completion_tokens)
+        registry.inc("trip_llm_cost_usd_total", labels, cost)
+    registry.inc("trip_llm_call_seconds_total", labels, seconds)
+
+    if stats is not None:
+        stats.llm_seconds += seconds
+        if error is not None:
+            stats.errors += 1
+        else:
+            stats.llm_calls += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.cached_prompt_tokens += cached_prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost += cost
+
+    logger.info(json.dumps({
+        "event": "llm_call", "task": task, "model": model, "seconds": seconds,
+        "prompt_tokens": prompt_tokens, "cached_prompt_tokens": cached_prompt_tokens,
+        "completion_tokens": completion_tokens, "cost": cost, "error": error,
+    }))
+
+
+def record_wait(started, ended=None):
+    # started and ended are time.perf_counter() readings
+    stats = _current_task.get()
+    if stats is not None:
+        stats.add_wait(started, time.perf_counter() if ended is None else ended)
+
+
+def record_retry(model, kind):
+    stats = _current_task.get()
+    task = stats.name if stats is not None else "unknown"
+    registry.inc("trip_llm_retries_total", {"task": task, "model": model, "kind": kind})
+    if stats is not None:
+        stats.retries += 1
+
+
+def record_task_failure(name, reason):
+    registry.inc("trip_task_failures_total", {"task": name, "reason": reason})
+    logger.info(json.dumps({"event": "task_failed", "task": name, "reason": reason}))
+
+
+def is_rate_limit(error):
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "rate limit" in text or "ratelimit" in text or "resource exhausted" in text
+
+
+class MeteredLLM(BaseLLM):
+    # Times every call to the wrapped LLM and counts its tokens, as reported by
+    # the backend, or estimated from the text when it reports nothing.
+
+    inner: BaseLLM
+
+    def __init__(self, inner, **kwargs):
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        pop_call_usage()
+        started = time.perf_counter()
+        try:
+            result = self.inner.call(messages, tools, callbacks, available_functions, **kwargs)
+        except Exception as e:
+            kind = "rate_limit" if is_rate_limit(e) else "error"
+            record_llm_call(self.model, time.perf_counter() - started, 0, 0, error=kind)
+            raise
+        usage = pop_call_usage()
+        record_llm_call(
+            self.model,
+            time.perf_counter() - started,
+            usage.get("prompt_tokens") or estimate_tokens(prompt_text(messages)),
+            usage.get("completion_tokens") or estimate_tokens(str(result)),
+            cached_prompt_tokens=usage.get("cached_prompt_tokens", 0),
+        )
+        return result
+
+    def supports_function_calling(self):
+        return self.inner.supports_function_calling()
+
+    def supports_stop_words(self):
+        return self.inner.supports_stop_words()
+
+    def get_context_window_size(self):
+        return self.inner.get_context_window_size()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    # Serves /metrics from a daemon thread; a no-op unless a port is configured
+    global _server
+    port = port or os.getenv("TRIP_METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
@@ -0,0 +1,213 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from crewai import BaseLLM
+
+from llm_backends import GEMINI_MODEL, shared_llm
+from metrics import MeteredLLM, current_task_name, registry
+from rate_limit import RateLimitedLLM
+
+# Models each task may use, cheapest acceptable first. Short, formulaic tasks go
+# to the lite model; the rest start on the main model. Later entries are fallbacks.
+FALLBACK_MODEL = "gemini/gemini-2.0-flash"
+TASK_MODELS = {
+    "logistics": [GEMINI_MODEL, FALLBACK_MODEL],
+    "budget": ["gemini/gemini-2.0-flash-lite", GEMINI_MODEL],
+    "planning": [GEMINI_MODEL, FALLBACK_MODEL],
+    "local_insights": ["gemini/gemini-2.0-flash-lite", GEMINI_MODEL],
+    "experiences": [GEMINI_MODEL, FALLBACK_MODEL],
+}
+
+# Set TRIP_MODEL_ROUTING=0 to send every task to GEMINI_MODEL
+MODEL_ROUTING = os.getenv("TRIP_MODEL_ROUTING", "1").lower() not in ("0", "false", "no")
+
+STATS_WINDOW = 200
+# Below this many samples a model's p95 is not trusted for hedging or ranking
+MIN_SAMPLES = 20
+# Until then, a call still unanswered after this many seconds is hedged
+COLD_HEDGE_SECONDS = 30.0
+# A model failing more often than this is skipped while others are healthy
+MAX_ERROR_RATE = 0.3
+# A model whose p95 is this many times the best candidate's is demoted
+SLOW_FACTOR = 2.0
+
+
+class ModelStats:
+    def __init__(self, window=STATS_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            if ok:
+                self._latencies.append(seconds)
+            self._outcomes.append(ok)
+
+    def p95(self):
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+
+class ModelRouter:
+    # Picks the model order for each task from rolling latency and error stats.
+    # Stats are kept per (task, model): an itinerary range is a much longer call
+    # than a logistics answer, so one model-wide p95 would hedge nearly every
+    # long call and demote models for the task mix they happened to serve.
+
+    def __init__(self, llms, task_models=TASK_MODELS, default_models=None, hedge=True):
+        self.llms = llms
+        self.task_models = task_models
+        self.default_models = default_models or list(llms)[:1]
+        self.hedge = hedge
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def model_stats(self, task, model):
+        with self._stats_lock:
+            if (task, model) not in self.stats:
+                self.stats[(task, model)] = ModelStats()
+            return self.stats[(task, model)]
+
+    def rank(self, task):
+        models = [m for m in self.task_models.get(task, self.default_models) if m in self.llms]
+        models = models or self.default_models
+        p95s = {m: self.model_stats(task, m).p95() for m in models}
+        known = [p95 for p95 in p95s.values() if p95 is not None]
+        best = min(known) if known else None
+
+        def key(item):
+            position, model = item
+            stats = self.model_stats(task, model)
+            unhealthy = stats.error_rate() > MAX_ERROR_RATE
+            p95 = p95s[model]
+            slow = best is not None and p95 is not None and p95 > SLOW_FACTOR * best
+            return (unhealthy, slow, position)
+
+        return [model for _, model in sorted(enumerate(models), key=key)]
+
+    def hedge_after(self, task, model):
+        # Seconds to wait on a call before sending a duplicate, or None to never hedge
+        if not self.hedge:
+            return None
+        p95 = self.model_stats(task, model).p95()
+        return COLD_HEDGE_SECONDS if p95 is None else p95
+
+    def record(self, task, model, seconds, ok):
+        self.model_stats(task, model).record(seconds, ok)
+
+
+class RoutedLLM(BaseLLM):
+    # Sends each call to the best model for the current task. A call running past
+    # that model's p95 for this task (COLD_HEDGE_SECONDS until it has one) gets a
+    # hedged duplicate on the next model, and the first answer wins. Each model
+    # gets a single attempt, so a 429 or timeout falls through to the remaining
+    # models at once; backoff and retries are left to a RetryingLLM around this.
+
+    router: ModelRouter
+    executor: ThreadPoolExecutor
+
+    def __init__(self, router, executor=None, **kwargs):
+        super().__init__(
+            # The wrapped client's own name, e.g. "fake/gemini-2.0-flash-exp" for
+            # the offline backend, since TripCrew's cache keys include it
+            model="routed/" + router.llms[router.default_models[0]].model,
+            router=router,
+            executor=executor or _hedge_pool,
+            **kwargs,
+        )
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        task = current_task_name()
+        candidates = self.router.rank(task)
+
+        def attempt(model):
+            started = time.perf_counter()
+            try:
+                result = self.router.llms[model].call(messages, tools, callbacks, available_functions, **kwargs)
+            except Exception:
+                self.router.record(task, model, time.perf_counter() - started, False)
+                raise
+            self.router.record(task, model, time.perf_counter() - started, True)
+            return result
+
+        hedge_after = self.router.hedge_after(task, candidates[0])
+        if hedge_after is None:
+            # Hedging is off: try the candidates in order on this thread
+            for model in candidates:
+                try:
+                    return attempt(model)
+                except Exception as e:
+                    error = e
+                    registry.inc("trip_llm_fallbacks_total", {"task": task or "unknown", "model": model})
+            raise error
+
+        def submit(model):
+            # Each attempt runs in a copy of this context so metrics and deadlines follow it
+            return self.executor.submit(contextvars.copy_context().run, attempt, model)
+
+        remaining = list(candidates[1:])
+        running = {submit(candidates[0]): candidates[0]}
+        hedged = False
+        while running:
+            timeout = hedge_after if not hedged and remaining else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                model = remaining.pop(0)
+                registry.inc("trip_llm_hedges_total", {"task": task or "unknown", "model": model})
+                running[submit(model)] = model
+                continue
+
+            for future in done:
+                model = running.pop(future)
+                if future.exception() is None:
+                    # The losing duplicate, if any, finishes in the background
+                    return future.result()
+                error = future.exception()
+                registry.inc("trip_llm_fallbacks_total", {"task": task or "unknown", "model": model})
+
+            if not running and remaining:
+                model = remaining.pop(0)
+                running[submit(model)] = model
+
+        raise error
+
+    def supports_function_calling(self):
+        return False
+
+    def get_context_window_size(self):
+        return min(llm.get_context_window_size() for llm in self.router.llms.values())
+
+
+# Attempts run here once hedging is active, so the task thread can wait on
+# the first of several answers
+_hedge_pool = ThreadPoolExecutor(max_workers=128, thread_name_prefix="llm-hedge")
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def shared_router():
+    # Built once per process so the latency and error stats cover every request
+    global _router
+    with _router_lock:
+        if _router is None:
+            models = {model for models in TASK_MODELS.values() for model in models}
+            # One attempt each; the retries happen above the router, see RoutedLLM
+            llms = {model: RateLimitedLLM(MeteredLLM(shared_llm(model)), max_attempts=1) for model in sorted(models)}
+            _router = ModelRouter(llms, default_models=[GEMINI_MODEL])
+        return _router
@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from task_cache import normalize
+
+DEFAULT_HISTORY_PATH = os.getenv("TRIP_HISTORY_PATH", ".trip_history.sqlite3")
+# Plans older than this are deleted, and only the newest HISTORY_MAX_PLANS are kept
+HISTORY_RETENTION_DAYS = float(os.getenv("TRIP_HISTORY_RETENTION_DAYS", "90"))
+HISTORY_MAX_PLANS = int(os.getenv("TRIP_HISTORY_MAX_PLANS", "50000"))
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode("utf-8"))
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class PlanHistory:
+    # Every completed plan with its inputs, in SQLite. Lookups read only the
+    # indexed columns; the zlib-compressed inputs and sections are unpacked
+    # when a single plan is loaded.
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, retention_days=HISTORY_RETENTION_DAYS, max_plans=HISTORY_MAX_PLANS):
+        self.retention = retention_days * 24 * 3600
+        self.max_plans = max_plans
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session TEXT,
+                destination TEXT NOT NULL,
+                destination_key TEXT NOT NULL,
+                travel_date TEXT,
+                duration INTEGER,
+                partial INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                inputs BLOB NOT NULL,
+                sections BLOB NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_session ON plans (session, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_destination ON plans (destination_key, travel_date)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_travel_date ON plans (travel_date)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_created ON plans (created_at)")
+        self._db.commit()
+
+    def record(self, inputs, sections, failed=None, session=None):
+        # sections: task name -> raw output. Returns the new plan's id.
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                """INSERT INTO plans (session, destination, destination_key, travel_date, duration,
+                                      partial, created_at, inputs, sections)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    session,
+                    inputs.get("destination_city", ""),
+                    normalize(inputs.get("destination_city", "")),
+                    inputs.get("travel_date"),
+                    inputs.get("duration"),
+                    int(bool(failed)),
+                    now,
+                    _pack(inputs),
+                    _pack({"sections": sections, "failed": failed or {}}),
+                ),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+            self._db.commit()
+            return cursor.lastrowid
+
+    def find(self, session=None, destination=None, date_from=None, date_to=None, limit=20):
+        # Newest first; travel dates are ISO strings, so the range is inclusive text comparison
+        clauses, params = ["created_at > ?"], [time.time() - self.retention]
+        if session is not None:
+            clauses.append("session = ?")
+            params.append(session)
+        if destination is not None:
+            clauses.append("destination_key = ?")
+            params.append(normalize(destination))
+        if date_from is not None:
+            clauses.append("travel_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("travel_date <= ?")
+            params.append(date_to)
+        with self._lock:
+            rows = self._db.execute(
+                f"""SELECT id, session, destination, travel_date, duration, partial, created_at
+                    FROM plans WHERE {' AND '.join(clauses)} ORDER BY created_at DESC LIMIT ?""",
+                (*params, limit),
+            ).fetchall()
+        keys = ("id", "session", "destination", "travel_date", "duration", "partial", "created_at")
+        return [dict(zip(keys, row), partial=bool(row[5])) for row in rows]
+
+    def load(self, plan_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT session, created_at, inputs, sections FROM plans WHERE id = ? AND created_at > ?",
+                (plan_id, time.time() - self.retention),
+            ).fetchone()
+        if row is None:
+            return None
+        session, created_at, inputs, payload = row
+        payload = _unpack(payload)
+        return {
+            "id": plan_id,
+            "session": session,
+            "created_at": created_at,
+            "inputs": _unpack(inputs),
+            "sections": payload["sections"],
+            "failed": payload["failed"],
+        }
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM plans WHERE created_at <= ?", (now - self.retention,))
+        self._db.execute(
+            """DELETE FROM plans WHERE id IN (
+                SELECT id FROM plans ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_plans,),
+        )
+
+
+_default_history = None
+_default_history_lock = threading.Lock()
+
+
+def get_default_history():
+    global _default_history
+    with _default_history_lock:
+        if _default_history is None:
+            _default_history = PlanHistory()
+        return _default_history
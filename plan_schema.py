@@ -0,0 +1,228 @@
+import json
+import typing
+
+from pydantic import BaseModel, ValidationError
+
+# Typed shapes for each task's output. Agents answer with compact JSON in
+# these shapes; it is validated, cached as JSON and rendered to markdown here.
+
+
+class Flight(BaseModel):
+    route: str
+    airline: str
+    time: str
+    price: str
+
+
+class Stay(BaseModel):
+    name: str
+    area: str
+    price_per_night: str
+
+
+class Logistics(BaseModel):
+    flights: list[Flight]
+    stays: list[Stay]
+    transport: list[str]
+
+
+class CostLine(BaseModel):
+    category: str
+    low: float
+    high: float
+    note: str = ""
+
+
+class Budget(BaseModel):
+    currency: str
+    lines: list[CostLine]
+    tips: list[str]
+
+
+class Slot(BaseModel):
+    time: str
+    activities: list[str]
+    dining: str = ""
+
+
+class Day(BaseModel):
+    day: int
+    theme: str
+    slots: list[Slot]
+
+
+class Itinerary(BaseModel):
+    days: list[Day]
+
+
+class Gem(BaseModel):
+    name: str
+    why: str
+
+
+class LocalInsights(BaseModel):
+    customs: list[str]
+    hidden_gems: list[Gem]
+    safety: list[str]
+    food: list[str]
+
+
+class Experience(BaseModel):
+    title: str
+    description: str
+    how_to_arrange: str
+
+
+class Experiences(BaseModel):
+    experiences: list[Experience]
+
+
+SCHEMAS = {
+    "logistics": Logistics,
+    "budget": Budget,
+    "planning": Itinerary,
+    "local_insights": LocalInsights,
+    "experiences": Experiences,
+}
+
+# Upper bound asked of every text value, which keeps completions short
+MAX_WORDS = 15
+
+
+def skeleton(model):
+    # An example instance with placeholder values, shown to the agent as the shape to fill
+    shape = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if typing.get_origin(annotation) is list:
+            item = typing.get_args(annotation)[0]
+            shape[name] = [skeleton(item) if isinstance(item, type) and issubclass(item, BaseModel) else "..."]
+        elif isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            shape[name] = skeleton(annotation)
+        elif annotation is int:
+            shape[name] = 1
+        elif annotation is float:
+            shape[name] = 0.0
+        else:
+            shape[name] = "..."
+    return shape
+
+
+def output_format(name, days=None):
+    # days: the day numbers an itinerary must cover, spelled out in the shape
+    shape = skeleton(SCHEMAS[name])
+    if days is not None:
+        shape["days"] = [dict(shape["days"][0], day=number) for number in days]
+    shape = json.dumps(shape, separators=(",", ":"))
+    return (
+        f"Reply with only a compact JSON object shaped like {shape}, without markdown or commentary. "
+        f"Keep every text value under {MAX_WORDS} words."
+    )
+
+
+def parse(name, raw):
+    # The validated model for a task's raw output, or None if it does not fit the schema
+    if not isinstance(raw, str):
+        return None
+    start, end = raw.find("{"), raw.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        return SCHEMAS[name].model_validate_json(raw[start:end + 1])
+    except ValidationError:
+        return None
+
+
+def guardrail(name, days=None):
+    # crewai Task guardrail: a non-conforming answer is sent back to the agent
+    # with the error; a valid one is kept as compact JSON. Itinerary days are
+    # renumbered to the ones asked for, and any extra days dropped.
+    def check(output):
+        model = parse(name, output.raw)
+        if model is None:
+            return False, output_format(name, days)
+        if days is not None:
+            if len(model.days) < len(days):
+                return False, f"Cover all {len(days)} days. {output_format(name, days)}"
+            model.days = model.days[:len(days)]
+            for day, number in zip(model.days, days):
+                day.day = number
+        return True, model.model_dump_json()
+    return check
+
+
+def to_data(name, raw):
+    # JSON-ready section for the API and batch output; placeholders stay text
+    model = parse(name, raw)
+    return model.model_dump() if model is not None else raw
+
+
+def render(name, raw):
+    model = parse(name, raw)
+    if model is None:
+        # Placeholders for failed sections, and outputs cached before the schemas
+        return raw
+    return _RENDERERS[name](model)
+
+
+def _render_logistics(logistics):
+    lines = ["#### ✈️ Flights"]
+    lines += [f"- **{f.route}**: {f.airline}, {f.time} · {f.price}" for f in logistics.flights]
+    lines += ["", "#### 🏨 Where to Stay"]
+    lines += [f"- **{s.name}** ({s.area}) · {s.price_per_night} per night" for s in logistics.stays]
+    lines += ["", "#### 🚇 Getting Around"]
+    lines += [f"- {tip}" for tip in logistics.transport]
+    return "\n".join(lines)
+
+
+def _render_budget(budget):
+    lines = ["| Category | Estimate | Notes |", "|---|---|---|"]
+    lines += [
+        f"| {line.category} | {line.low:,.0f}–{line.high:,.0f} {budget.currency} | {line.note} |"
+        for line in budget.lines
+    ]
+    low = sum(line.low for line in budget.lines)
+    high = sum(line.high for line in budget.lines)
+    lines += [f"| **Total** | **{low:,.0f}–{high:,.0f} {budget.currency}** | |", "", "#### 💡 Money-Saving Tips"]
+    lines += [f"- {tip}" for tip in budget.tips]
+    return "\n".join(lines)
+
+
+def _render_day(day):
+    lines = [f"#### Day {day.day}: {day.theme}"]
+    for slot in day.slots:
+        dining = f" · 🍽️ {slot.dining}" if slot.dining else ""
+        lines.append(f"- **{slot.time}:** {'; '.join(slot.activities)}{dining}")
+    return "\n".join(lines)
+
+
+def _render_itinerary(itinerary):
+    return "\n\n".join(_render_day(day) for day in itinerary.days)
+
+
+def _render_local_insights(insights):
+    lines = ["#### 🙏 Cultural Dos and Don'ts"]
+    lines += [f"- {item}" for item in insights.customs]
+    lines += ["", "#### 💎 Hidden Gems"]
+    lines += [f"- **{gem.name}**: {gem.why}" for gem in insights.hidden_gems]
+    lines += ["", "#### 🛡️ Safety and Practical Tips"]
+    lines += [f"- {item}" for item in insights.safety]
+    lines += ["", "#### 🍜 Must-Try Food"]
+    lines += [f"- {item}" for item in insights.food]
+    return "\n".join(lines)
+
+
+def _render_experiences(experiences):
+    return "\n\n".join(
+        f"#### {i}. {e.title}\n{e.description}\n\n*How to arrange:* {e.how_to_arrange}"
+        for i, e in enumerate(experiences.experiences, 1)
+    )
+
+
+_RENDERERS = {
+    "logistics": _render_logistics,
+    "budget": _render_budget,
+    "planning": _render_itinerary,
+    "local_insights": _render_local_insights,
+    "experiences": _render_experiences,
+}
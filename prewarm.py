@@ -0,0 +1,195 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from batch_plan import RowRateLimiter
+from trip_agents import TripCrew   # import AFTER .env is loaded
+
+# The "Need Inspiration?" list in app.py, then other frequently planned cities
+POPULAR_DESTINATIONS = [
+    "Rome, Italy", "Kyoto, Japan", "Athens, Greece",
+    "Maldives", "Bali, Indonesia", "Santorini, Greece",
+    "New Zealand", "Costa Rica", "Iceland",
+    "Bangkok, Thailand", "Barcelona, Spain", "Tokyo, Japan",
+    "Paris, France", "London, United Kingdom", "New York, USA", "Lisbon, Portugal",
+    "Istanbul, Turkey", "Dubai, UAE", "Prague, Czech Republic", "Amsterdam, Netherlands",
+]
+
+# Tasks whose prompt depends on the destination and season alone (local
+# insights), or also on the traveller profile (experiences). Logistics,
+# budget and the itinerary depend on dates, budget and trip length, so they
+# are left to the request itself.
+PREWARM_TASKS = ["local_insights", "experiences"]
+
+# Traveller profiles the experiences task is warmed for. The first is the
+# app's untouched form; each maps to a different experience level.
+PREWARM_PROFILES = [
+    {"travel_style": "Solo Adventure", "interests": ["Culture", "Food"]},
+    {"travel_style": "Couple's Getaway", "interests": ["Culture", "Food"]},
+    {"travel_style": "Family Trip", "interests": ["Relaxation", "Food"]},
+    {"travel_style": "Friends' Adventure", "interests": ["Adventure", "Nature"]},
+]
+
+# Mid-month of each season TripCrew._get_season knows
+SEASON_MONTHS = {"Winter": 1, "Spring": 4, "Summer": 7, "Fall": 10}
+
+# Local hours the job may run in, e.g. "01:00-06:00"; it may wrap past midnight
+PREWARM_WINDOW = os.getenv("TRIP_PREWARM_WINDOW", "01:00-06:00")
+# Crews started per minute; each makes one LLM call per task not yet cached
+PREWARM_RPM = float(os.getenv("TRIP_PREWARM_RPM", "6"))
+
+
+def parse_window(text):
+    start, end = (datetime.strptime(part.strip(), "%H:%M").time() for part in text.split("-"))
+    return start, end
+
+
+def in_window(window, now=None):
+    start, end = window
+    now = (now or datetime.now()).time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+def seconds_until_window(window, now=None):
+    now = now or datetime.now()
+    if in_window(window, now):
+        return 0.0
+    opens = datetime.combine(now.date(), window[0])
+    if opens <= now:
+        opens += timedelta(days=1)
+    return (opens - now).total_seconds()
+
+
+def season_dates(today=None):
+    # The next mid-season date for each season, soonest first, since those
+    # trips are the ones being planned now
+    today = today or date.today()
+    dates = {}
+    for season, month in SEASON_MONTHS.items():
+        day = date(today.year, month, 15)
+        if day < today:
+            day = date(today.year + 1, month, 15)
+        dates[season] = day.isoformat()
+    return sorted(dates.items(), key=lambda item: item[1])
+
+
+def destination_names(destinations):
+    # Each destination as listed and as its bare city name: "Rome" and
+    # "Rome, Italy" are different cache keys, and similar_plans only reuses
+    # outputs whose city qualifiers match, so both forms need warming
+    names = []
+    for destination in destinations:
+        for name in (destination, destination.split(",")[0].strip()):
+            if name and name not in names:
+                names.append(name)
+    return names
+
+
+def prewarm_inputs(destinations=POPULAR_DESTINATIONS, profiles=PREWARM_PROFILES, today=None):
+    # One inputs dict per (season, destination name, profile). The fields no
+    # pre-warmed task reads are filled with the app's defaults.
+    for season, travel_date in season_dates(today):
+        for destination in destination_names(destinations):
+            for profile in profiles:
+                yield {
+                    "source_city": "",
+                    "destination_city": destination,
+                    "travel_date": travel_date,
+                    "duration": 7,
+                    "preferred_time": "Morning",
+                    "budget": "Moderate",
+                    "pace_preference": "Moderate",
+                    "location_preference": "City Center",
+                    "include_photography": False,
+                    "include_cooking": False,
+                    "include_nightlife": False,
+                    "include_wellness": False,
+                    **profile,
+                }
+
+
+def missing_tasks(crew, tasks):
+    return [name for name in tasks if crew.cache.get(crew.task_keys[name]) is None]
+
+
+def warm(inputs, tasks, limiter, window):
+    # Returns "cached", "warmed", "failed" or "skipped" (outside the window)
+    crew = TripCrew(inputs, tasks=tasks)
+    todo = missing_tasks(crew, tasks)
+    if not todo:
+        return "cached"
+    if window is not None and not in_window(window):
+        return "skipped"
+    limiter.wait()
+    if window is not None and not in_window(window):
+        return "skipped"
+    crew = TripCrew(inputs, tasks=todo)
+    crew.kickoff()
+    return "failed" if crew.failed else "warmed"
+
+
+def run_prewarm(destinations=POPULAR_DESTINATIONS, tasks=PREWARM_TASKS, rpm=PREWARM_RPM,
+                window=PREWARM_WINDOW, concurrency=2):
+    # Fills the task cache for every popular destination and season. Entries
+    # still cached are skipped, so a nightly run only refreshes expired ones.
+    window = parse_window(window) if window else None
+    limiter = RowRateLimiter(rpm)
+    counts = {"cached": 0, "warmed": 0, "failed": 0, "skipped": 0}
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(warm, inputs, tasks, limiter, window) for inputs in prewarm_inputs(destinations)]
+        for future in as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"pre-warm failed: {e}", file=sys.stderr)
+    print(
+        f"pre-warm: {counts['warmed']} warmed, {counts['cached']} already cached, "
+        f"{counts['failed']} failed, {counts['skipped']} left for the next window "
+        f"in {time.time() - started:.1f}s",
+        file=sys.stderr,
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate destination and season task outputs into the task cache")
+    parser.add_argument("--destinations", help="file with one destination per line (default: built-in list)")
+    parser.add_argument("--rpm", type=float, default=PREWARM_RPM, help="maximum crews started per minute")
+    parser.add_argument("-c", "--concurrency", type=int, default=2, help="crews to run at once")
+    parser.add_argument("--window", default=PREWARM_WINDOW, help="local off-peak hours, e.g. 01:00-06:00")
+    parser.add_argument("--now", action="store_true", help="run immediately, ignoring the window")
+    parser.add_argument("--forever", action="store_true", help="run again in every window, e.g. as a service")
+    args = parser.parse_args()
+
+    destinations = POPULAR_DESTINATIONS
+    if args.destinations:
+        with open(args.destinations) as f:
+            destinations = [line.strip() for line in f if line.strip()]
+    window = None if args.now else args.window
+
+    while True:
+        if window:
+            wait = seconds_until_window(parse_window(window))
+            if wait:
+                print(f"waiting {wait / 3600:.1f}h for the {window} window", file=sys.stderr)
+                time.sleep(wait)
+        counts = run_prewarm(destinations, rpm=args.rpm, window=window, concurrency=args.concurrency)
+        if not args.forever:
+            break
+        # One pass per window; without a window, one pass an hour
+        if not window:
+            time.sleep(3600)
+        while window and in_window(parse_window(window)):
+            time.sleep(60)
+    sys.exit(1 if counts["failed"] else 0)
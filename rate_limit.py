@@ -0,0 +1,211 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from crewai import BaseLLM
+
+from metrics import is_rate_limit, record_retry, record_wait
+
+# Steady-state LLM requests per second across the whole process, and the burst
+# allowed on top of it. The limiter backs off below this on 429s.
+LLM_RPS = float(os.getenv("TRIP_LLM_RPS", "5"))
+LLM_BURST = int(os.getenv("TRIP_LLM_BURST", "10"))
+LLM_MAX_ATTEMPTS = int(os.getenv("TRIP_LLM_MAX_ATTEMPTS", "5"))
+
+# Seconds for a throttled limiter to climb back to full rate if no new 429 arrives
+RATE_RECOVERY_SECONDS = 30.0
+
+# 429s arriving within this many seconds of a halving are the same overload,
+# e.g. every call of one burst, so they pause the bucket but do not halve again
+THROTTLE_DEBOUNCE_SECONDS = 2.0
+
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+# Monotonic time by which the current task must finish; set per task by TripCrew
+_deadline = contextvars.ContextVar("trip_llm_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RetriesExhausted(RuntimeError):
+    pass
+
+
+@contextmanager
+def deadline_scope(seconds):
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def backoff_delay(attempt, retry_after=None):
+    # Full jitter: uniform in [0, base * 2^attempt], capped; the server's hint wins
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def retry_after_seconds(error):
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    if is_rate_limit(error) or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class AdaptiveTokenBucket:
+    # Token bucket whose refill rate halves on a throttle signal, at most once
+    # per THROTTLE_DEBOUNCE_SECONDS, and climbs back linearly over
+    # RATE_RECOVERY_SECONDS, never above the configured ceiling.
+
+    def __init__(self, rate=LLM_RPS, burst=LLM_BURST, min_rate=0.1):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.halved_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        # Returns False if no token could be had within timeout seconds; a
+        # timeout already spent, e.g. a passed deadline, never gets one
+        if timeout is not None and timeout <= 0:
+            return False
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+                self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate / RATE_RECOVERY_SECONDS)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            if give_up is not None and now + wait > give_up:
+                return False
+            time.sleep(wait)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            if self.halved_at is None or now - self.halved_at >= THROTTLE_DEBOUNCE_SECONDS:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.halved_at = now
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+
+# Shared by every crew in the process, so sessions, jobs and batch rows stay under one quota
+llm_limiter = AdaptiveTokenBucket()
+
+
+class RetryingLLM(BaseLLM):
+    # Retries transient failures with jittered exponential backoff, within the
+    # current task's deadline. With max_attempts=1 the provider's error is
+    # raised as it is, so the caller can retry elsewhere, e.g. RoutedLLM on
+    # its next model.
+
+    inner: BaseLLM
+    max_attempts: int = LLM_MAX_ATTEMPTS
+
+    def __init__(self, inner, **kwargs):
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        # These are the only retries: TripCrew's agents are built with
+        # max_retry_limit=0, so crewai does not re-run the whole task (and
+        # repeat all of these attempts) once they give up. Errors are raised
+        # outside the except blocks so the provider error is not chained onto ours.
+        error = None
+        for attempt in range(self.max_attempts):
+            self._before_attempt()
+            try:
+                result = self.inner.call(messages, tools, callbacks, available_functions, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                error = e
+            else:
+                return result
+
+            retry_after = retry_after_seconds(error)
+            self._on_transient_error(error, retry_after)
+            if self.max_attempts == 1:
+                raise error
+            delay = backoff_delay(attempt, retry_after)
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded("Task deadline passed while retrying the LLM")
+            if attempt + 1 < self.max_attempts:
+                record_retry(self.model, "rate_limit" if is_rate_limit(error) else "transient")
+                time.sleep(delay)
+
+        raise RetriesExhausted(
+            f"LLM still failing after {self.max_attempts} attempts ({type(error).__name__})"
+        )
+
+    def _before_attempt(self):
+        pass
+
+    def _on_transient_error(self, error, retry_after):
+        pass
+
+    def supports_function_calling(self):
+        return self.inner.supports_function_calling()
+
+    def supports_stop_words(self):
+        return self.inner.supports_stop_words()
+
+    def get_context_window_size(self):
+        return self.inner.get_context_window_size()
+
+
+class RateLimitedLLM(RetryingLLM):
+    # A RetryingLLM that takes a token from the shared bucket before every
+    # attempt and slows the bucket down on 429s.
+
+    limiter: AdaptiveTokenBucket
+
+    def __init__(self, inner, limiter=None, **kwargs):
+        super().__init__(inner, limiter=limiter or llm_limiter, **kwargs)
+
+    def _before_attempt(self):
+        waiting = time.perf_counter()
+        acquired = self.limiter.acquire(timeout=remaining_time())
+        record_wait(waiting)
+        if not acquired:
+            raise DeadlineExceeded("Task deadline passed while waiting for LLM quota")
+
+    def _on_transient_error(self, error, retry_after):
+        if is_rate_limit(error):
+            self.limiter.on_throttle(retry_after)
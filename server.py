@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from metrics import registry
+from plan_history import get_default_history
+from plan_schema import to_data
+from trip_agents import TripCrew, TASK_ORDER   # import AFTER .env is loaded
+
+# The fields every TripCrew prompt needs; the rest of app.py's inputs dict is optional
+REQUIRED_INPUTS = [
+    "source_city", "destination_city", "travel_date", "duration",
+    "preferred_time", "interests", "budget", "pace_preference",
+]
+
+# Trip lengths the app's form allows
+MAX_DURATION = 30
+
+WORKERS = int(os.getenv("PLANNER_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("PLANNER_QUEUE_SIZE", "100"))
+# Finished jobs are kept this long for polling, then dropped
+JOB_TTL = int(os.getenv("PLANNER_JOB_TTL", "3600"))
+
+
+class Job:
+    def __init__(self, inputs, session=None):
+        self.id = uuid.uuid4().hex
+        self.inputs = inputs
+        self.session = session
+        self.plan_id = None
+        self.status = "queued"
+        self.sections = {}
+        self.failed_sections = {}
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "completed_sections": [name for name in TASK_ORDER if name in self.sections],
+            "failed_sections": self.failed_sections,
+            "error": self.error,
+            "plan_id": self.plan_id,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PlanningService:
+    # Jobs wait in a bounded queue and are run by a fixed number of workers,
+    # each driving one crew at a time on the thread pool.
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, job_ttl=JOB_TTL, history=None):
+        self.workers = workers
+        self.job_ttl = job_ttl
+        self.history = history or get_default_history()
+        self.jobs = {}
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner")
+        self._tasks = []
+
+    async def start(self, app):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire_jobs()))
+
+    async def stop(self, app):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, inputs, session=None):
+        job = Job(inputs, session)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        return job
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                await loop.run_in_executor(self.executor, self._run, job)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self.queue.task_done()
+
+    def _run(self, job):
+        # Sections become visible to pollers as soon as each task finishes
+        crew = TripCrew(job.inputs)
+        raw = {}
+        for name, output in crew.stream():
+            raw[name] = output.raw
+            # A new dict each time: the event loop may be serializing the old one
+            job.sections = dict(job.sections, **{name: to_data(name, output.raw)})
+            job.failed_sections = dict(crew.failed)
+        job.plan_id = self.history.record(job.inputs, raw, crew.failed, session=job.session)
+
+    async def _expire_jobs(self):
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.job_ttl
+            for job_id, job in list(self.jobs.items()):
+                if job.finished_at is not None and job.finished_at < cutoff:
+                    del self.jobs[job_id]
+
+
+def validate_inputs(inputs):
+    # Returns what is wrong with the trip inputs, or None; the crew would
+    # otherwise fail on them minutes later on a worker
+    missing = [key for key in REQUIRED_INPUTS if key not in inputs]
+    if missing:
+        return f"Missing inputs: {', '.join(missing)}"
+    for key in REQUIRED_INPUTS:
+        if key not in ("duration", "interests") and not isinstance(inputs[key], str):
+            return f"{key} must be a string"
+    interests = inputs["interests"]
+    if not isinstance(interests, list) or not all(isinstance(item, str) for item in interests):
+        return "interests must be a list of strings"
+    duration = inputs["duration"]
+    if isinstance(duration, bool) or not isinstance(duration, int) or not 1 <= duration <= MAX_DURATION:
+        return f"duration must be a whole number of days from 1 to {MAX_DURATION}"
+    try:
+        date.fromisoformat(inputs["travel_date"])
+    except ValueError:
+        return "travel_date must be an ISO date (YYYY-MM-DD)"
+    return None
+
+
+routes = web.RouteTableDef()
+
+
+@routes.post("/plans")
+async def submit_plan(request):
+    try:
+        inputs = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be a JSON object of trip inputs")
+    if not isinstance(inputs, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object of trip inputs")
+    problem = validate_inputs(inputs)
+    if problem:
+        raise web.HTTPBadRequest(text=problem)
+
+    service = request.app["service"]
+    try:
+        job = service.submit(inputs, session=request.headers.get("X-Session-Id"))
+    except asyncio.QueueFull:
+        raise web.HTTPServiceUnavailable(text="Planner is at capacity, try again shortly")
+
+    return web.json_response(
+        {
+            "job_id": job.id,
+            "status_url": f"/plans/{job.id}",
+            "result_url": f"/plans/{job.id}/result",
+        },
+        status=202,
+    )
+
+
+def _get_job(request):
+    job = request.app["service"].jobs.get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text="Unknown job id")
+    return job
+
+
+@routes.get("/plans/{job_id}")
+async def plan_status(request):
+    return web.json_response(_get_job(request).summary())
+
+
+@routes.get("/plans/{job_id}/result")
+async def plan_result(request):
+    job = _get_job(request)
+    if job.status == "failed":
+        return web.json_response(job.summary(), status=500)
+    if job.status != "done":
+        # Partial sections are included so clients can render progressively
+        return web.json_response(dict(job.summary(), sections=job.sections), status=202)
+    return web.json_response(dict(job.summary(), sections=job.sections))
+
+
+def _session(request):
+    # History holds personal details (health, accessibility and dietary
+    # needs), so it is only served to the session that planned the trip
+    session = request.headers.get("X-Session-Id")
+    if not session:
+        raise web.HTTPUnauthorized(text="X-Session-Id header is required")
+    return session
+
+
+@routes.get("/history")
+async def history(request):
+    # The session's past plans, newest first; every filter is optional
+    session = _session(request)
+    query = request.query
+    try:
+        limit = min(int(query.get("limit", "20")), 100)
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    plans = request.app["service"].history.find(
+        session=session,
+        destination=query.get("destination"),
+        date_from=query.get("date_from"),
+        date_to=query.get("date_to"),
+        limit=limit,
+    )
+    return web.json_response({"plans": plans})
+
+
+@routes.get("/history/{plan_id}")
+async def history_plan(request):
+    session = _session(request)
+    try:
+        plan_id = int(request.match_info["plan_id"])
+    except ValueError:
+        raise web.HTTPNotFound(text="Unknown plan id")
+    plan = request.app["service"].history.load(plan_id)
+    if plan is None or plan["session"] != session:
+        # Another session's plan looks the same as a missing one
+        raise web.HTTPNotFound(text="Unknown plan id")
+    plan["sections"] = {name: to_data(name, raw) for name, raw in plan["sections"].items()}
+    return web.json_response(plan)
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    return web.Response(text=registry.render_prometheus(), content_type="text/plain")
+
+
+@routes.get("/health")
+async def health(request):
+    service = request.app["service"]
+    return web.json_response({"status": "ok", "queued": service.queue.qsize(), "jobs": len(service.jobs)})
+
+
+def create_app(service=None):
+    app = web.Application()
+    app["service"] = service or PlanningService()
+    app.add_routes(routes)
+    app.on_startup.append(app["service"].start)
+    app.on_cleanup.append(app["service"].stop)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the trip planner as an HTTP service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import random
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+from plan_schema import parse
+from task_cache import normalize
+
+# Set TRIP_SIMILAR_PLANS=0 to only ever reuse exact cache hits
+SIMILAR_PLANS = os.getenv("TRIP_SIMILAR_PLANS", "1").lower() not in ("0", "false", "no")
+MAX_ENTRIES = int(os.getenv("TRIP_SIMILAR_MAX_ENTRIES", "200000"))
+
+# Minimum Jaccard similarity between the prompt features of a request and a
+# stored task output for that output to be reused. Logistics and budget are
+# left out: with about ten features, any one changed field (the budget level,
+# the dates, the source city) already drops below 0.85, and each of those
+# changes the prices they quote, so they only reuse exact cache hits.
+SIMILARITY_THRESHOLDS = {
+    "planning": 0.85,
+    "local_insights": 0.7,
+    "experiences": 0.85,
+}
+
+# A stored itinerary up to this many days longer can be cut down to the
+# requested length, so duration is matched separately for planning
+STRETCH_FIELDS = {"planning": "duration"}
+MAX_EXTRA_DAYS = 2
+
+# The city is weighted over its qualifiers in the features, but a match must
+# also have the same qualifiers. A bare name does not match a qualified one
+# either: nothing here can tell whether "Paris" meant "Paris, France" or
+# "Paris, Texas", and a wrong guess serves another city's plan. prewarm.py
+# warms both forms of the popular destinations instead.
+CITY_FIELDS = ("source_city", "destination_city")
+CITY_WEIGHT = 3
+
+# List fields a stored output must cover: an itinerary planned for Culture and
+# Food is no answer to Culture, Food and Nightlife, however similar the rest is
+SUBSET_FIELDS = {"planning": "interests", "experiences": "interests"}
+
+# MinHash LSH: a candidate must agree on all rows of at least one band.
+# Each bucket keeps only its most recent entries, which bounds lookup time.
+BANDS = 4
+BAND_ROWS = 3
+BUCKET_SIZE = 16
+
+_MASK64 = (1 << 64) - 1
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_SEEDS = [random.Random(i).getrandbits(64) for i in range(BANDS * BAND_ROWS)]
+
+
+def features(task_name, fields):
+    # Order-free tokens for a task's prompt fields; lists become one token per
+    # item, and free-text values are compared after normalize()
+    stretch = STRETCH_FIELDS.get(task_name)
+    tokens = set()
+    for key, value in fields.items():
+        if key == stretch:
+            continue
+        if key in CITY_FIELDS and isinstance(value, str):
+            city, *qualifiers = [normalize(part) for part in value.split(",")]
+            tokens.update(f"{key}={city}#{i}" for i in range(CITY_WEIGHT))
+            tokens.update(f"{key}+{part}" for part in qualifiers if part)
+        elif isinstance(value, (list, tuple, set)):
+            tokens.update(f"{key}={item}" for item in normalize(value))
+        else:
+            tokens.add(f"{key}={normalize(value)}")
+    return tokens
+
+
+def qualifiers(fields):
+    # The normalized qualifiers of each city field, e.g. ("destination_city", ("texas",))
+    return tuple(
+        (key, tuple(part for part in (normalize(p) for p in fields[key].split(",")[1:]) if part))
+        for key in CITY_FIELDS
+        if isinstance(fields.get(key), str)
+    )
+
+
+def _subset_items(task_name, fields):
+    value = fields.get(SUBSET_FIELDS.get(task_name))
+    return frozenset(normalize(value)) if isinstance(value, (list, tuple, set)) else None
+
+
+def _hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _bands(task_name, hashes):
+    signature = [min(((h ^ seed) * _MULTIPLIER) & _MASK64 for h in hashes) for seed in _SEEDS]
+    return [
+        hash((task_name, band, *signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]))
+        for band in range(BANDS)
+    ]
+
+
+def trim_days(text, days):
+    # Cuts an itinerary down to its first `days` days; None if it cannot be cut
+    itinerary = parse("planning", text)
+    if itinerary is not None:
+        itinerary.days = [day for day in itinerary.days if day.day <= days]
+        return itinerary.model_dump_json()
+    # Free-text itineraries cached before plan_schema, cut at their "Day N" headings
+    match = re.search(rf"^[#*\s]*Day\s+{days + 1}\b", text, re.MULTILINE | re.IGNORECASE)
+    return text[:match.start()].rstrip() if match else None
+
+
+class Match:
+    def __init__(self, key, similarity, stretch=None):
+        self.key = key
+        self.similarity = similarity
+        # Stored value of the task's stretch field, e.g. the itinerary's length
+        self.stretch = stretch
+
+
+class PlanIndex:
+    # Finds the stored task output closest to a request by MinHash LSH over its
+    # prompt features, verified with exact Jaccard similarity. Only hashed
+    # features and cache keys are held here; the outputs stay in TaskCache.
+    # Least recently used entries are dropped beyond max_entries.
+
+    def __init__(self, max_entries=MAX_ENTRIES, thresholds=SIMILARITY_THRESHOLDS):
+        self.max_entries = max_entries
+        self.thresholds = thresholds
+        # cache key (bytes) -> (task name, packed feature hashes, stretch value,
+        # city qualifiers, subset field items)
+        self._entries = OrderedDict()
+        # band hash -> entry id, or a list of them once several share the band
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, task_name, fields, key):
+        if task_name not in self.thresholds:
+            return
+        hashes = sorted({_hash(token) for token in features(task_name, fields)})
+        entry_id = bytes.fromhex(key)
+        bands = _bands(task_name, hashes)
+        stretch = fields.get(STRETCH_FIELDS.get(task_name))
+        entry = (task_name, struct.pack(f"{len(hashes)}Q", *hashes), stretch,
+                 qualifiers(fields), _subset_items(task_name, fields))
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+                return
+            self._entries[entry_id] = entry
+            for band in bands:
+                bucket = self._buckets.get(band)
+                if bucket is None:
+                    self._buckets[band] = entry_id
+                elif isinstance(bucket, bytes):
+                    self._buckets[band] = [bucket, entry_id]
+                else:
+                    bucket.append(entry_id)
+                    if len(bucket) > BUCKET_SIZE:
+                        del bucket[0]
+            while len(self._entries) > self.max_entries:
+                self._evict()
+
+    def nearest(self, task_name, fields):
+        threshold = self.thresholds.get(task_name)
+        if threshold is None:
+            return None
+        query = {_hash(token) for token in features(task_name, fields)}
+        bands = _bands(task_name, query)
+        stretch_field = STRETCH_FIELDS.get(task_name)
+        wanted = fields.get(stretch_field)
+        wanted_qualifiers = qualifiers(fields)
+        wanted_items = _subset_items(task_name, fields)
+
+        best, best_id = None, None
+        with self._lock:
+            candidates = set()
+            for band in bands:
+                bucket = self._buckets.get(band, ())
+                if isinstance(bucket, bytes):
+                    candidates.add(bucket)
+                else:
+                    candidates.update(bucket)
+            for entry_id in candidates:
+                name, packed, stretch, stored_qualifiers, items = self._entries.get(
+                    entry_id, (None, b"", None, (), None))
+                if name != task_name or stored_qualifiers != wanted_qualifiers:
+                    continue
+                if wanted_items is not None and (items is None or not wanted_items <= items):
+                    continue
+                if stretch_field and (wanted is None or stretch is None
+                                      or not int(wanted) <= int(stretch) <= int(wanted) + MAX_EXTRA_DAYS):
+                    continue
+                stored = set(struct.unpack(f"{len(packed) // 8}Q", packed))
+                overlap = len(query & stored)
+                similarity = overlap / (len(query) + len(stored) - overlap)
+                if similarity >= threshold and (best is None or similarity > best.similarity):
+                    best, best_id = Match(entry_id.hex(), similarity, stretch), entry_id
+            if best_id is not None:
+                self._entries.move_to_end(best_id)
+        return best
+
+    def _evict(self):
+        entry_id, (name, packed, *_) = self._entries.popitem(last=False)
+        hashes = struct.unpack(f"{len(packed) // 8}Q", packed)
+        for band in _bands(name, hashes):
+            bucket = self._buckets.get(band)
+            if bucket == entry_id:
+                del self._buckets[band]
+            elif isinstance(bucket, list) and entry_id in bucket:
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = PlanIndex()
+        return _default_index
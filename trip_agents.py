@@ -1,23 +1,597 @@
-from crewai import Agent, Task, Crew, LLM
+from crewai import Agent, Task, TaskOutput
+from crewai.events.event_listener import event_listener
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
 from datetime import datetime
+import contextvars
 import os
+import queue
+import threading
+import time
+
+from llm_backends import PROMPT_DETAILS_MARKER, shared_llm
+from model_router import MODEL_ROUTING, RoutedLLM, shared_router
+from metrics import MeteredLLM, TaskStats, record_task, record_task_failure, record_wait, task_scope
+from plan_schema import SCHEMAS, Day, Itinerary, guardrail, output_format, parse
+from rate_limit import RateLimitedLLM, RetryingLLM, deadline_scope
+from similar_plans import SIMILAR_PLANS, STRETCH_FIELDS, get_default_index, trim_days
+from singleflight import task_flights
+from task_cache import get_default_cache, make_key, normalize
+
+# Position of each task in tasks_output; app.py reads results by index.
+TASK_ORDER = ["logistics", "budget", "planning", "local_insights", "experiences"]
+
+# A task only waits for the tasks whose output it reads as context.
+# Everything else runs in parallel, so a kickoff takes as long as the
+# longest chain rather than the sum of all five LLM calls.
+TASK_DEPENDENCIES = {
+    "logistics": [],
+    "budget": ["logistics"],
+    "planning": [],
+    "local_insights": [],
+    "experiences": [],
+}
+
+# Seconds each task may take, retries included, before its section is given up
+# on and the rest of the plan is returned without it
+TASK_DEADLINES = {
+    "logistics": 120,
+    "budget": 90,
+    "planning": 180,
+    "local_insights": 90,
+    "experiences": 90,
+}
+
+# The form fields each task prompt interpolates. A task's cache key is built
+# from these alone, so e.g. local insights are shared by everyone going to
+# the same city.
+TASK_INPUTS = {
+    "logistics": ["source_city", "destination_city", "budget", "travel_date", "preferred_time", "location_preference"],
+    "budget": ["duration", "destination_city", "budget"],
+    "planning": ["duration", "destination_city", "interests", "pace_preference", "travel_style"],
+    "local_insights": ["destination_city"],
+    "experiences": [
+        "destination_city", "travel_date", "travel_style", "interests",
+        "include_photography", "include_cooking", "include_nightlife", "include_wellness",
+    ],
+}
+
+# Bump when a prompt changes, or when cached outputs must not be served again
+PROMPT_VERSION = 7
+
+# Extra attempts an agent gets when its answer does not fit the task's schema
+SCHEMA_RETRIES = 1
+
+# crewai's step-by-step console output; set TRIP_VERBOSE=0 to silence it
+VERBOSE = os.getenv("TRIP_VERBOSE", "1").lower() not in ("0", "false", "no")
+# Crew used to apply this to crewai's shared console listener; tasks now run without one
+event_listener.verbose = VERBOSE
+event_listener.formatter.verbose = VERBOSE
+
+# Longer trips are planned as a shared outline plus day ranges of this size,
+# generated in parallel, so latency tracks the chunk size, not the trip length
+PLAN_CHUNK_DAYS = 5
+
+# How often events() checks for partial task outputs while tasks run
+PARTIAL_POLL_SECONDS = 0.1
+
+
+# The five agents, built once per process by AgentPool and leased to tasks
+AGENT_SPECS = {
+    "travel_coordinator": {
+        "role": "Travel Coordinator",
+        "goal": "Plan comprehensive travel logistics including flights and hotels",
+        "backstory": "Senior travel coordinator with expertise in flight bookings, hotel arrangements, and travel logistics",
+    },
+    "experience_curator": {
+        "role": "Experience Curator",
+        "goal": "Design unique and memorable experiences based on traveler preferences",
+        "backstory": "Creative experience designer who specializes in crafting unique, personalized travel moments",
+    },
+    "planner": {
+        "role": "Travel Planner",
+        "goal": "Create a detailed itinerary based on preferences and logistics",
+        "backstory": "Expert travel planner with years of experience in creating personalized travel plans",
+    },
+    "local_expert": {
+        "role": "Local Expert",
+        "goal": "Provide authentic local insights and cultural recommendations",
+        "backstory": "A knowledgeable local expert with deep understanding of the destination",
+    },
+    "budget_analyst": {
+        "role": "Budget Analyst",
+        "goal": "Optimize travel expenses and provide cost estimates",
+        "backstory": "Financial expert specializing in travel budgeting and cost optimization",
+    },
+}
+
+TASK_AGENTS = {
+    "logistics": "travel_coordinator",
+    "budget": "budget_analyst",
+    "planning": "planner",
+    "local_insights": "local_expert",
+    "experiences": "experience_curator",
+}
+
+
+# The instructions of each prompt, the same for every request. The request's
+# own values follow them (see describe()), so every prompt an agent sends
+# starts with the same text and the provider can cache that prefix.
+TASK_PROMPTS = {
+    "logistics": """Plan the travel logistics for the trip in the details below:
+1. Recommend flights that fit the budget level, travel date and preferred time.
+2. Recommend accommodation that fits the budget level and location preference.
+3. Provide transportation options (airport transfers, local transit tips).""",
+    "budget": """Analyze the costs of the trip in the details below.
+Provide estimated cost ranges for: Flights, Accommodation, Food, Activities.
+Base the flight and accommodation estimates on the logistics report you are given.
+Include 3 specific money-saving tips for this destination.""",
+    "planning": """Create a travel plan for the trip in the details below, matching its interests, pace and style.
+For each day, include Morning, Afternoon, and Evening activities with dining suggestions.""",
+    "outline": """Sketch the trip in the details below, matching its interests, pace and style.
+Give one line per day naming the area to base the day in and its theme, without repeating sights across days.
+Days you are given as already planned stay as they are; plan the other days around them.""",
+    "planning_days": """Using the trip outline you are given, write the listed days of the travel plan for the trip in the details below, matching its interests, pace and style.
+For each day, include Morning, Afternoon, and Evening activities with dining suggestions.
+Cover only the days to write, and do not repeat sights from days already planned.""",
+    "local_insights": """Provide local insights for the destination in the details below:
+1. Cultural dos and don'ts.
+2. 2-3 hidden gems (non-touristy spots).
+3. Safety tips and practical advice.
+4. Must-try local food recommendations.""",
+    "experiences": """Design 3 unique, memorable experiences for the traveler in the details below, suited to their experience level, the season and their interests.
+Include photography, cooking, nightlife or wellness experiences only if they are among the selected extras.""",
+}
+
+
+def describe(prompt, details):
+    # A task description: the static instructions and output shape, then this
+    # request's (label, value) pairs, destination first so that requests for
+    # the same place share a longer prefix. Itineraries get their shape from
+    # the expected output instead, with the requested days spelled out.
+    lines = [TASK_PROMPTS[prompt]]
+    if prompt in SCHEMAS and prompt != "planning":
+        lines.append(output_format(prompt))
+    lines += ["", PROMPT_DETAILS_MARKER] + [f"- {label}: {value}" for label, value in details]
+    return "\n".join(lines)
+
+
+def day_ranges(duration, size=PLAN_CHUNK_DAYS):
+    return [(first, min(first + size - 1, duration)) for first in range(1, duration + 1, size)]
+
+
+def required_tasks(names):
+    # The given tasks plus everything they read as context
+    required = set(names)
+    grew = True
+    while grew:
+        upstream = {dep for name in required for dep in TASK_DEPENDENCIES[name]}
+        grew = not upstream <= required
+        required |= upstream
+    return required
+
+
+def affected_tasks(old_inputs, new_inputs):
+    # Tasks whose prompt reads a changed field, plus everything downstream of them
+    changed = {
+        key for key in set(old_inputs) | set(new_inputs)
+        if normalize(old_inputs.get(key)) != normalize(new_inputs.get(key))
+    }
+    affected = {name for name, keys in TASK_INPUTS.items() if changed.intersection(keys)}
+    grew = True
+    while grew:
+        dependents = {name for name, deps in TASK_DEPENDENCIES.items() if affected.intersection(deps)}
+        grew = not dependents <= affected
+        affected |= dependents
+    return affected
+
+
+class AgentPool:
+    # Agents are costly to build (pydantic validation, executor and prompt
+    # setup), so they are returned for the next request instead of being
+    # rebuilt. Only their configuration is safe to share: a run stores its
+    # executor and prompt on the agent, so each is leased to one task at a
+    # time, and crewai's failure counter is cleared on every lease since
+    # crewai itself never resets it.
+
+    def __init__(self, llm):
+        self.llm = llm
+        self._idle = {key: [] for key in AGENT_SPECS}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, key):
+        with self._lock:
+            agent = self._idle[key].pop() if self._idle[key] else None
+        if agent is None:
+            # RateLimitedLLM already retries the calls; a crewai retry would re-run
+            # the task and every one of those attempts again
+            agent = Agent(**AGENT_SPECS[key], llm=self.llm, allow_delegation=False, verbose=VERBOSE,
+                          max_retry_limit=0)
+        agent._times_executed = 0
+        try:
+            yield agent
+        finally:
+            with self._lock:
+                self._idle[key].append(agent)
+
+    def idle(self):
+        with self._lock:
+            return {key: len(agents) for key, agents in self._idle.items()}
+
+
+_agent_pools = {}
+_agent_pools_lock = threading.Lock()
+
+
+def shared_agent_pool(llm=None):
+    # One pool per LLM per process. Without an LLM, each task is routed to its
+    # own models (see model_router); any crewai LLM works too, e.g.
+    # llm_backends.FakeLLM for offline runs.
+    with _agent_pools_lock:
+        if id(llm) not in _agent_pools:
+            if llm is not None:
+                wrapped = RateLimitedLLM(MeteredLLM(llm))
+            elif MODEL_ROUTING:
+                wrapped = RetryingLLM(RoutedLLM(shared_router()))
+            else:
+                wrapped = RateLimitedLLM(MeteredLLM(shared_llm()))
+            # The pool keeps llm alive, so its id is not reused by another object
+            _agent_pools[id(llm)] = (llm, AgentPool(wrapped))
+        return _agent_pools[id(llm)][1]
+
+
+class TripResult:
+    def __init__(self, inputs, outputs, failed=None):
+        self.inputs = inputs
+        self.outputs = outputs
+        # Task name -> reason, for sections that hold a placeholder instead of a result
+        self.failed = failed or {}
+
+    @property
+    def tasks_output(self):
+        return [self.outputs[name] for name in TASK_ORDER if name in self.outputs]
+
+    @property
+    def raw(self):
+        return "\n\n".join(output.raw for output in self.tasks_output)
+
 
 class TripCrew:
-    def __init__(self, inputs):
+    def __init__(self, inputs, cache=None, previous=None, llm=None, similar=None, tasks=None):
         self.inputs = inputs
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable is not set")
+        # Only these tasks (and their upstream) run; the rest are left out of the result
+        self.run_tasks = required_tasks(tasks) if tasks is not None else set(TASK_ORDER)
+        self.cache = cache if cache is not None else get_default_cache()
+        # Near-duplicate lookup for requests that miss the exact cache
+        if similar is None and SIMILAR_PLANS:
+            similar = get_default_index()
+        self.similar = similar
+
+        # Outputs of the previous TripResult that this edit does not touch
+        self.reused = {}
+        if previous is not None:
+            stale = affected_tasks(previous.inputs, inputs)
+            self.reused = {
+                name: output for name, output in previous.outputs.items()
+                if name not in stale and name not in previous.failed
+            }
+
+        # Agents and LLM clients are shared; a crew only builds its Task objects
+        self.pool = shared_agent_pool(llm)
+        self.llm = self.pool.llm
+        # metrics.TaskStats for each task this crew has run, cache hits included
+        self.stats = {}
+        self.failed = {}
+        # (task name, partial TaskOutput) from worker threads, drained by events()
+        self._partials = queue.Queue()
+
+        self._create_tasks()
+        self.task_keys = {}
+        for name in TASK_ORDER:
+            self._task_key(name)
+
+    def kickoff(self):
+        outputs = dict(self.stream())
+        return TripResult(self.inputs, outputs, self.failed)
+
+    def stream(self):
+        # Yields (task name, TaskOutput) pairs in completion order
+        for name, output, final in self.events():
+            if final:
+                yield name, output
+
+    def events(self):
+        # Like stream(), but yields (name, output, final) and also reports
+        # parts of a task as they finish, e.g. itinerary day ranges, with
+        # final=False. Each task ends with exactly one final output.
+        outputs = {}
+        pending = {}
+        for name, deps in TASK_DEPENDENCIES.items():
+            if name not in self.run_tasks:
+                continue
+            if name in self.reused:
+                outputs[name] = self.reused[name]
+                yield name, outputs[name], True
+            else:
+                pending[name] = deps
+
+        running = {}
+        deadlines = {}
+        pool = ThreadPoolExecutor(max_workers=len(TASK_ORDER))
+        try:
+            while pending or running:
+                ready = [name for name, deps in pending.items() if all(d in outputs for d in deps)]
+                for name in ready:
+                    del pending[name]
+                    context = "\n\n".join(
+                        outputs[d].raw for d in TASK_DEPENDENCIES[name] if d not in self.failed
+                    )
+                    future = pool.submit(self._run_task, name, context, time.perf_counter())
+                    running[future] = name
+                    deadlines[future] = time.monotonic() + TASK_DEADLINES[name]
 
+                timeout = max(0.0, min(deadlines[f] for f in running) - time.monotonic())
+                done, _ = wait(running, timeout=min(timeout, PARTIAL_POLL_SECONDS), return_when=FIRST_COMPLETED)
+                while not self._partials.empty():
+                    name, output = self._partials.get_nowait()
+                    if name not in outputs:
+                        yield name, output, False
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except Exception as e:
+                        outputs[name] = self._failed_output(name, e)
+                    yield name, outputs[name], True
 
-        self.llm = LLM(
-            model="gemini/gemini-2.0-flash-exp",
-            temperature=0.7,
-            api_key=api_key
+                # A hung call cannot be interrupted; its thread is left to finish
+                # (and fill the cache) while the plan goes on without it
+                now = time.monotonic()
+                for future in [f for f in running if deadlines[f] <= now]:
+                    name = running.pop(future)
+                    outputs[name] = self._failed_output(
+                        name, TimeoutError(f"no answer within {TASK_DEADLINES[name]} seconds")
+                    )
+                    yield name, outputs[name], True
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _failed_output(self, name, error):
+        reason = str(error) or type(error).__name__
+        self.failed[name] = reason
+        if name in self.stats:
+            self.stats[name].failed = reason
+        record_task_failure(name, type(error).__name__)
+        task = self.tasks[name]
+        return TaskOutput(
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=f"⚠️ This section could not be generated ({reason}). Submit the form again to retry just this part.",
+            agent=AGENT_SPECS[TASK_AGENTS[name]]["role"],
+        )
+
+    def _run_task(self, name, context, submitted):
+        started = time.perf_counter()
+        stats = self.stats[name] = TaskStats(name)
+        stats.queue_seconds = started - submitted
+        with task_scope(stats), deadline_scope(TASK_DEADLINES[name]):
+            try:
+                return self._execute_task(name, context)
+            finally:
+                stats.wall_seconds = time.perf_counter() - started
+                record_task(stats)
+
+    def _execute_task(self, name, context):
+        output = self._cached_output(name)
+        if output is not None:
+            self._index(name)
+        else:
+            output = self._similar_output(name)
+        if output is None:
+            # Identical tasks already running in other crews are awaited, not repeated.
+            # A run missing a failed upstream section is not the output its key
+            # stands for, so it neither shares a flight with full runs nor is cached.
+            degraded = any(dep in self.failed for dep in TASK_DEPENDENCIES[name])
+            flight = self.task_keys[name] + (":degraded" if degraded else "")
+            waiting = time.perf_counter()
+            output, shared = task_flights.do(flight, lambda: self._generate(name, context, degraded))
+            self.stats[name].shared = shared
+            if shared:
+                record_wait(waiting)
+        return output
+
+    def _cached_output(self, name):
+        raw = self.cache.get(self.task_keys[name])
+        if raw is None:
+            return None
+        task = self.tasks[name]
+        self.stats[name].cached = True
+        return TaskOutput(
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=raw,
+            agent=AGENT_SPECS[TASK_AGENTS[name]]["role"],
+        )
+
+    def _similarity_fields(self, name):
+        # A task's own prompt fields plus those of the tasks it reads as context,
+        # so e.g. a budget is not reused for a trip from another source city
+        fields = {}
+        for dep in TASK_DEPENDENCIES[name]:
+            fields.update(self._similarity_fields(dep))
+        fields.update(self._prompt_fields(name))
+        return fields
+
+    def _index(self, name):
+        if self.similar is not None:
+            self.similar.add(name, self._similarity_fields(name), self.task_keys[name])
+
+    def _similar_output(self, name):
+        if self.similar is None:
+            return None
+        fields = self._similarity_fields(name)
+        match = self.similar.nearest(name, fields)
+        raw = self.cache.get(match.key) if match is not None else None
+        if raw is None:
+            return None
+        stretch = STRETCH_FIELDS.get(name)
+        if stretch and int(match.stretch) != int(fields[stretch]):
+            # A slightly longer itinerary, cut down to the requested days
+            raw = trim_days(raw, int(fields[stretch]))
+            if raw is None:
+                return None
+
+        # Stored under this request's own key too, so a repeat is an exact hit
+        self.cache.set(self.task_keys[name], raw)
+        task = self.tasks[name]
+        self.stats[name].similar = round(match.similarity, 3)
+        return TaskOutput(
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=raw,
+            agent=AGENT_SPECS[TASK_AGENTS[name]]["role"],
+        )
+
+    def _generate(self, name, context, degraded=False):
+        # Another crew may have finished this task between our cache miss and now
+        output = self._cached_output(name)
+        if output is not None:
+            return output
+
+        task = self.tasks[name]
+        if name == "planning":
+            output = self._run_planning()
+        else:
+            with self.pool.lease(TASK_AGENTS[name]) as agent:
+                output = task.execute_sync(agent=agent, context=context or None)
+        if not degraded:
+            self.cache.set(self.task_keys[name], output.raw)
+            self._index(name)
+        return output
+
+    def _run_planning(self):
+        # Itineraries are cached per day as well as whole. Day ranges whose days
+        # are all cached, e.g. the start of a trip that was just made longer, are
+        # reused; the rest are generated in parallel from a shared outline that
+        # is given the reused days, since they may come from a shorter plan.
+        task = self.tasks["planning"]
+        duration = int(self.inputs['duration'])
+        days = {}
+        for number in range(1, duration + 1):
+            raw = self.cache.get(self._day_key(number))
+            if raw is not None:
+                days[number] = Day.model_validate_json(raw)
+        missing = [(first, last) for first, last in day_ranges(duration)
+                   if any(number not in days for number in range(first, last + 1))]
+
+        if missing and duration <= PLAN_CHUNK_DAYS:
+            with self.pool.lease("planner") as planner:
+                self._store_days(days, task.execute_sync(agent=planner).raw)
+        elif missing:
+            self._run_planning_in_chunks(days, missing)
+
+        return TaskOutput(
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=Itinerary(days=[days[number] for number in sorted(days)]).model_dump_json(),
+            agent=AGENT_SPECS["planner"]["role"],
         )
 
-        self.crew = self._create_crew()
-        
+    def _run_planning_in_chunks(self, days, ranges):
+        details = self._planning_details()
+        planned = self._planned_days(days)
+
+        outline_task = Task(
+            description=describe("outline", details),
+            expected_output="A numbered list with one line per day of the trip."
+        )
+        with self.pool.lease("planner") as planner:
+            outline = outline_task.execute_sync(agent=planner, context=planned or None).raw
+        if planned:
+            outline = f"{planned}\n\n{outline}"
+
+        def plan_days(first, last):
+            numbers = range(first, last + 1)
+            chunk_task = Task(
+                description=describe("planning_days", details + [("Days to write", f"{first} to {last}")]),
+                expected_output=f"A travel itinerary for days {first} to {last}. {output_format('planning', numbers)}",
+                guardrail=guardrail("planning", numbers),
+                guardrail_max_retries=SCHEMA_RETRIES
+            )
+            # Agents keep per-execution state, so each concurrent chunk leases its own
+            with self.pool.lease("planner") as planner:
+                return chunk_task.execute_sync(agent=planner, context=outline).raw
+
+        # Each chunk runs in a copy of this context so its LLM calls count towards planning
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, plan_days, *days_range) for days_range in ranges]
+            for future in as_completed(futures):
+                self._store_days(days, future.result())
+                # The days so far, for events() to show while the other chunks run
+                partial = Itinerary(days=[days[number] for number in sorted(days)])
+                self._partials.put(("planning", self._partial_output("planning", partial.model_dump_json())))
+
+    @staticmethod
+    def _planned_days(days):
+        # The cached days as context for the outline and the chunks around them
+        if not days:
+            return ""
+        lines = ["Days already planned:"]
+        for number in sorted(days):
+            sights = "; ".join(activity for slot in days[number].slots for activity in slot.activities)
+            lines.append(f"Day {number}: {days[number].theme} ({sights})")
+        return "\n".join(lines)
+
+    def _store_days(self, days, raw):
+        for day in parse("planning", raw).days:
+            days[day.day] = day
+            self.cache.set(self._day_key(day.day), day.model_dump_json())
+
+    def _day_key(self, number):
+        # Everything the planning prompt reads except the trip length
+        fields = {key: value for key, value in self._prompt_fields("planning").items() if key != "duration"}
+        return make_key("planning_day", fields, PROMPT_VERSION, self.llm.model, number)
+
+    def _partial_output(self, name, raw):
+        task = self.tasks[name]
+        return TaskOutput(
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=raw,
+            agent=AGENT_SPECS[TASK_AGENTS[name]]["role"],
+        )
+
+    def _planning_details(self):
+        # The trip length comes last, so plans of any length share the rest of the prompt
+        return [
+            ("Destination", self.inputs['destination_city']),
+            ("Interests", ', '.join(self.inputs['interests'])),
+            ("Pace", self.inputs['pace_preference']),
+            ("Style", self.inputs.get('travel_style', 'General')),
+            ("Length", f"{self.inputs['duration']} days"),
+        ]
+
+    def _prompt_fields(self, name):
+        fields = {key: self.inputs.get(key) for key in TASK_INPUTS[name]}
+        if name == "experiences":
+            # The prompt only sees the season and experience level derived from these
+            fields["travel_date"] = self._get_season(self.inputs['travel_date'])
+            fields["travel_style"] = self._get_experience_level(
+                self.inputs.get('travel_style', 'Casual'),
+                self.inputs['interests']
+            )
+        return fields
+
+    def _task_key(self, name):
+        if name not in self.task_keys:
+            # Upstream keys are part of the key, since their outputs are part of the prompt
+            upstream = [self._task_key(dep) for dep in TASK_DEPENDENCIES[name]]
+            self.task_keys[name] = make_key(
+                name, self._prompt_fields(name), PROMPT_VERSION, self.llm.model, *upstream
+            )
+        return self.task_keys[name]
+
     def _get_season(self, date_str):
         try:
             date_obj = datetime.strptime(date_str, '%Y-%m-%d')
@@ -39,121 +613,138 @@ class TripCrew:
         else:
             return "Casual Traveler"
 
-    def _create_crew(self):
+    def _create_tasks(self):
         season = self._get_season(self.inputs['travel_date'])
         experience_level = self._get_experience_level(
             self.inputs.get('travel_style', 'Casual'),
             self.inputs['interests']
         )
-        
-        travel_coordinator = Agent(
-            role="Travel Coordinator",
-            goal="Plan comprehensive travel logistics including flights and hotels",
-            backstory="Senior travel coordinator with expertise in flight bookings, hotel arrangements, and travel logistics",
-            llm=self.llm,
-            allow_delegation=False,
-            verbose=True
-        )
-        
-        experience_curator = Agent(
-            role="Experience Curator",
-            goal="Design unique and memorable experiences based on traveler preferences",
-            backstory="Creative experience designer who specializes in crafting unique, personalized travel moments",
-            llm=self.llm,
-            allow_delegation=False,
-            verbose=True
-        )
-
-        planner = Agent(
-            role="Travel Planner",
-            goal="Create a detailed itinerary based on preferences and logistics",
-            backstory="Expert travel planner with years of experience in creating personalized travel plans",
-            llm=self.llm,
-            allow_delegation=False,
-            verbose=True
-        )
-
-        local_expert = Agent(
-            role="Local Expert",
-            goal="Provide authentic local insights and cultural recommendations",
-            backstory="A knowledgeable local expert with deep understanding of the destination",
-            llm=self.llm,
-            allow_delegation=False,
-            verbose=True
-        )
-
-        budget_analyst = Agent(
-            role="Budget Analyst",
-            goal="Optimize travel expenses and provide cost estimates",
-            backstory="Financial expert specializing in travel budgeting and cost optimization",
-            llm=self.llm,
-            allow_delegation=False,
-            verbose=True
-        )
+        destination = self.inputs['destination_city']
+        budget = self.inputs['budget']
+        extras = [
+            label for label, key in (
+                ("Photography", "include_photography"), ("Cooking", "include_cooking"),
+                ("Nightlife", "include_nightlife"), ("Wellness", "include_wellness"),
+            )
+            if self.inputs.get(key)
+        ]
 
         logistics_task = Task(
-            description=f"""
-            Plan travel logistics from {self.inputs['source_city']} to {self.inputs['destination_city']}:
-            1. Research and recommend flights:
-               - Budget level: {self.inputs['budget']}
-               - Travel date: {self.inputs['travel_date']}
-               - Preferred time: {self.inputs['preferred_time']}
-            2. Find suitable hotels/accommodations:
-               - Budget level: {self.inputs['budget']}
-               - Location preference: {self.inputs.get('location_preference', 'City Center')}
-            3. Provide transportation options (airport transfers, local transit tips).
-            """,
-            expected_output="Detailed travel logistics report including flight options, accommodation recommendations with prices, and local transport details.",
-            agent=travel_coordinator
+            description=describe("logistics", [
+                ("Destination", destination),
+                ("Budget level", budget),
+                ("Location preference", self.inputs.get('location_preference', 'City Center')),
+                ("From", self.inputs['source_city']),
+                ("Travel date", self.inputs['travel_date']),
+                ("Preferred time", self.inputs['preferred_time']),
+            ]),
+            expected_output="Flight options, accommodation recommendations with prices, and local transport tips, as JSON in the shape above.",
+            guardrail=guardrail("logistics"),
+            guardrail_max_retries=SCHEMA_RETRIES
         )
 
         budget_analysis_task = Task(
-            description=f"""
-            Analyze costs for the {self.inputs['duration']}-day trip to {self.inputs['destination_city']} with a {self.inputs['budget']} budget.
-            Provide estimated cost ranges for: Flights, Accommodation, Daily expenses (food/activities).
-            Include 3 specific money-saving tips for this destination.
-            """,
-            expected_output="Comprehensive budget breakdown by category with total estimated trip cost and money-saving tips.",
-            agent=budget_analyst
+            description=describe("budget", [
+                ("Destination", destination),
+                ("Budget level", budget),
+                ("Length", f"{self.inputs['duration']} days"),
+            ]),
+            expected_output="One cost line per category with a low and high amount in one currency, and money-saving tips, as JSON in the shape above.",
+            context=[logistics_task],
+            guardrail=guardrail("budget"),
+            guardrail_max_retries=SCHEMA_RETRIES
         )
 
+        # Only run itself for trips short enough to plan in one call
+        planning_days = range(1, int(self.inputs['duration']) + 1)
         planning_task = Task(
-            description=f"""
-            Create a {self.inputs['duration']}-day travel plan for {self.inputs['destination_city']}.
-            Consider:
-            - Interests: {', '.join(self.inputs['interests'])}
-            - Pace: {self.inputs['pace_preference']}
-            - Style: {self.inputs.get('travel_style', 'General')}
-            For each day, include Morning, Afternoon, and Evening activities with dining suggestions.
-            """,
-            expected_output="A detailed day-by-day travel itinerary matching user preferences.",
-            agent=planner
+            description=describe("planning", self._planning_details()),
+            expected_output=f"A day-by-day travel itinerary matching user preferences. {output_format('planning', planning_days)}",
+            guardrail=guardrail("planning", planning_days),
+            guardrail_max_retries=SCHEMA_RETRIES
         )
 
         local_insights_task = Task(
-            description=f"""
-            Provide local insights for {self.inputs['destination_city']}:
-            1. Cultural dos and don'ts.
-            2. 2-3 hidden gems (non-touristy spots).
-            3. Safety tips and practical advice.
-            4. Must-try local food recommendations.
-            """,
-            expected_output="Structured report with cultural norms, hidden gems, safety tips, and food recommendations.",
-            agent=local_expert
+            description=describe("local_insights", [("Destination", destination)]),
+            expected_output="Cultural norms, hidden gems, safety tips, and food recommendations, as JSON in the shape above.",
+            guardrail=guardrail("local_insights"),
+            guardrail_max_retries=SCHEMA_RETRIES
         )
 
         experiences_task = Task(
-            description=f"""
-            Design 3 unique, memorable experiences for a {experience_level} traveler in {self.inputs['destination_city']} during {season}.
-            Base it on interests: {', '.join(self.inputs['interests'])}.
-            Include if selected: Photography ({self.inputs.get('include_photography')}), Cooking ({self.inputs.get('include_cooking')}), Nightlife ({self.inputs.get('include_nightlife')}), Wellness ({self.inputs.get('include_wellness')}).
-            """,
-            expected_output="List of 3 unique, personalized experience descriptions with details on how to arrange them.",
-            agent=experience_curator
+            description=describe("experiences", [
+                ("Destination", destination),
+                ("Season", season),
+                ("Experience level", experience_level),
+                ("Interests", ', '.join(self.inputs['interests'])),
+                ("Selected extras", ', '.join(extras) or "none"),
+            ]),
+            expected_output="3 unique, personalized experiences with details on how to arrange them, as JSON in the shape above.",
+            guardrail=guardrail("experiences"),
+            guardrail_max_retries=SCHEMA_RETRIES
         )
 
-        return Crew(
-            agents=[travel_coordinator, budget_analyst, planner, local_expert, experience_curator],
-            tasks=[logistics_task, budget_analysis_task, planning_task, local_insights_task, experiences_task],
-            verbose=True
-        )
\ No newline at end of file
+        self.tasks = {
+            "logistics": logistics_task,
+            "budget": budget_analysis_task,
+            "planning": planning_task,
+            "local_insights": local_insights_task,
+            "experiences": experiences_task,
+        }
+
+
+class TripComparison:
+    # Several variants of one trip planned side by side, e.g. the same trip at
+    # each budget level. Each variant is its own TripCrew and all of them start
+    # together, so a task whose prompt fields agree across variants has one
+    # cache key and runs once through task_flights; only the tasks that differ
+    # fan out.
+
+    def __init__(self, variants, cache=None, llm=None):
+        self.variants = variants
+        self.crews = [TripCrew(inputs, cache=cache, llm=llm) for inputs in variants]
+        first = self.crews[0].task_keys
+        self.varying = [
+            name for name in TASK_ORDER
+            if any(crew.task_keys[name] != first[name] for crew in self.crews[1:])
+        ]
+
+    def labels(self):
+        # Names each variant by the form fields that differ between them
+        fields = [
+            key for key in self.variants[0]
+            if any(normalize(v.get(key)) != normalize(self.variants[0].get(key)) for v in self.variants[1:])
+        ]
+        def label(inputs):
+            parts = [f"{inputs[key]} days" if key == "duration" else str(inputs[key]) for key in fields]
+            return " · ".join(parts) or "Variant"
+        return [label(inputs) for inputs in self.variants]
+
+    def kickoff(self):
+        outputs = [{} for _ in self.crews]
+        for index, name, output in self.stream():
+            outputs[index][name] = output
+        return [TripResult(crew.inputs, out, crew.failed) for crew, out in zip(self.crews, outputs)]
+
+    def stream(self):
+        # Yields (variant index, task name, TaskOutput) in completion order
+        results = queue.Queue()
+
+        def drain(index):
+            try:
+                for name, output in self.crews[index].stream():
+                    results.put((index, name, output))
+            finally:
+                results.put((index, None, None))
+
+        with ThreadPoolExecutor(max_workers=len(self.crews)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, drain, i) for i in range(len(self.crews))]
+            remaining = len(futures)
+            while remaining:
+                index, name, output = results.get()
+                if name is None:
+                    remaining -= 1
+                else:
+                    yield index, name, output
+            for future in futures:
+                future.result()